@@ -7,6 +7,7 @@ __author__= "Sean Heelan"
 __email__ = "sean.heelan@gmail.com"
 
 import os
+import json
 import logging
 
 class CompileArgsError(Exception):
@@ -22,9 +23,11 @@ def load_project_data(data_file):
         the arguments passed to a single instantiation of the compiler.
 
     @rtype: Dictionary
-    @returns: A mapping from path-to-source-file to a list of strings where
-        each element is an argument that was passed to the compiler during
-        the compilation of the associated file.
+    @returns: A mapping from absolute path-to-source-file to a list of
+        strings where each element is an argument that was passed to the
+        compiler during the compilation of the associated file. Relative
+        paths in the arguments are resolved against the directory the
+        compiler was run from.
 
     """
 
@@ -42,23 +45,77 @@ def load_project_data(data_file):
 
     return ret
 
+# Options whose value is a path passed as the next argument (-I include)
+PATH_OPTS = ("-I", "-isystem", "-iquote", "-idirafter", "-include",
+             "-include-pch", "-imacros", "-isysroot", "--sysroot")
+
+# The options of PATH_OPTS that also accept their value joined to them
+# (-Iinclude, --sysroot=/path). A joined value starting with "-" belongs to
+# a different option (-include-pch) or is not a path (-I-), so is left alone.
+JOINED_PATH_OPTS = ("-I", "-isystem", "-iquote", "-idirafter", "-include",
+                    "-imacros", "-isysroot", "--sysroot=")
+
+# Environment variables logged by the compiler wrapper, the option each of
+# their entries is equivalent to and the extensions of the source files, and
+# so the languages, that the compiler applies them to
+ENV_PATH_OPTS = [("CPATH", "-I", (".c", ".cpp")),
+                 ("C_INCLUDE_PATH", "-isystem", (".c",)),
+                 ("CPLUS_INCLUDE_PATH", "-isystem", (".cpp",))]
+
+def __parse_record(line):
+    """Split a line logged by the compiler wrapper into its components.
+
+    Lines are either JSON records containing the working directory, the
+    arguments and the environment of the compiler invocation, or, for logs
+    created by older versions of the wrapper, the bare space separated
+    arguments. In the latter case paths are resolved against the current
+    working directory.
+
+    @type line: String
+    @param line: A single line from the file logged by the compiler wrapper
+
+    @rtype: Tuple of (String, List of Strings, Dict)
+    @return: The working directory, the arguments and the environment
+
+    """
+
+    line = line.strip()
+    if line.startswith("{"):
+        # The JSON decoder gives us unicode strings but libclang wants bytes
+        record = json.loads(line)
+        env = dict((str(k), v.encode("utf-8"))
+                   for k, v in record.get("env", {}).items())
+        return (record["cwd"].encode("utf-8"),
+                [a.encode("utf-8") for a in record["args"]], env)
+
+    return (os.getcwd(), line.split(" "), {})
+
+def __resolve_path(cwd, path):
+    """Return 'path' as an absolute path, treating relative paths as being
+    relative to 'cwd'
+
+    """
+
+    return os.path.normpath(os.path.join(cwd, path))
+
 def __process_data_line(line):
     """Parse the arguments provided to one invocation of the compiler
 
     @type line: String
     @param line: A single line from the file logged by the compiler wrapper
 
-    @rtype: List of Tuple of (String, Set of Strings)
-    @return: A list in which each element is a tuple containing a source file
-        name and the corresponding set of compiler options
+    @rtype: List of Tuple of (String, List of Strings)
+    @return: A list in which each element is a tuple containing an absolute
+        source file name and the corresponding list of compiler options
 
     """
 
     log = logging.getLogger("process_data_line")
-    line = line.split(" ")
+    cwd, line, env = __parse_record(line)
     skip_next = False
+    resolve_next = False
     source_files = set()
-    args = set()
+    args = []
 
     for arg in line:
         # On a -o arg we want to skip the filename that comes next
@@ -66,13 +123,19 @@ def __process_data_line(line):
             skip_next = False
             continue
 
+        # The path belonging to an option given on its own, e.g. -I include
+        if resolve_next:
+            resolve_next = False
+            args.append(__resolve_path(cwd, arg))
+            continue
+
         if arg.endswith(".c") or arg.endswith(".cpp"):
-            path = os.path.abspath(arg)
+            path = __resolve_path(cwd, arg)
             if not os.path.exists(path):
                 log.error("Found a reference to %s but it does not exist" % \
                           path)
                 continue
-            source_files.add(arg)
+            source_files.add(path)
             continue
         elif arg == "-c" or arg == "-emit-ast" or arg == "-fsyntax-only":
             # These would just be ignored by clang_parseTranslationUnit anyway
@@ -80,13 +143,31 @@ def __process_data_line(line):
         elif arg == "-o":
             skip_next = True
             continue
+        elif arg in PATH_OPTS:
+            args.append(arg)
+            resolve_next = True
+            continue
         else:
-            args.add(arg)
+            for opt in JOINED_PATH_OPTS:
+                if arg.startswith(opt) and len(arg) > len(opt) and \
+                        arg[len(opt)] != "-":
+                    arg = opt + __resolve_path(cwd, arg[len(opt):])
+                    break
+            args.append(arg)
             continue
 
     ret = []
     for f_name in source_files:
-        ret.append((f_name, args))
+        # Entries in the include path environment variables are searched
+        # after any directories given on the command line
+        f_args = list(args)
+        for var, opt, exts in ENV_PATH_OPTS:
+            if not f_name.endswith(exts):
+                continue
+            for d in env.get(var, "").split(os.pathsep):
+                if d:
+                    f_args.extend([opt, __resolve_path(cwd, d)])
+        ret.append((f_name, f_args))
 
     return ret
 
@@ -97,7 +178,7 @@ def __update_results(res, info):
     @type res: Dict
     @param res: The result dictionary to update
 
-    @type info: List of Tuple of (String, Set of Strings)
+    @type info: List of Tuple of (String, List of Strings)
     @param info: The new data to insert
 
     @rtype: None
@@ -0,0 +1,267 @@
+"""Compile the output of the compiler wrapper into an indexed binary file so
+that the compiler arguments for a source file can be found without reading
+and tokenizing the whole log.
+
+The index is built once with compile_project_data (or by running this module
+as a script) and opened with CompiledProjectData, which maps the file into
+memory and resolves lookups through an on-disk hash table. Opening an index
+costs the same regardless of the size of the build.
+
+File layout (all integers are little endian):
+
+    header      MAGIC, file count, slot count, arg vector count and the
+                offsets of the three sections below
+    slots       open addressing hash table of (path hash, arg vector id,
+                path offset) entries
+    arg vectors table of (string offset, argument count) entries
+    strings     NUL terminated paths and arguments
+
+"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import sys
+import mmap
+import zlib
+import struct
+import logging
+import argparse
+
+from interparser.ccargparse import load_project_data, CompileArgsError
+
+MAGIC = "IPCCIDX1"
+DESC = "Compile the compiler wrapper log into a binary index"
+
+HEADER = struct.Struct("<8sIIIQQQ")
+SLOT = struct.Struct("<IIQ")
+ARGVEC = struct.Struct("<QI")
+
+# Path offset used to mark an unused hash table slot
+EMPTY_SLOT = 0xffffffffffffffff
+
+def path_hash(path):
+    """Return the stable 32 bit hash used to place 'path' in the index"""
+
+    return zlib.crc32(path) & 0xffffffff
+
+def is_compiled_index(data_file):
+    """Check if 'data_file' is an index created by compile_project_data
+
+    @type data_file: String
+    @param data_file: The file to check
+
+    @rtype: Boolean
+
+    """
+
+    with open(data_file, "rb") as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+def compile_project_data(data_file, index_file):
+    """Convert the output of the compiler wrapper into an index file
+
+    @type data_file: String
+    @param data_file: The output of our compiler wrapper
+
+    @type index_file: String
+    @param index_file: The path of the index file to create
+
+    @rtype: Integer
+    @return: The number of source files in the index
+
+    """
+
+    return write_index(load_project_data(data_file), index_file)
+
+def write_index(comp_args, index_file):
+    """Write the mapping of source files to compiler arguments 'comp_args'
+    to an index file
+
+    @type comp_args: Dictionary
+    @param comp_args: A mapping as returned by load_project_data
+
+    @type index_file: String
+    @param index_file: The path of the index file to create
+
+    @rtype: Integer
+    @return: The number of source files in the index
+
+    """
+
+    log = logging.getLogger("write_index")
+
+    n_slots = 1
+    while n_slots < 2 * len(comp_args):
+        n_slots *= 2
+
+    strings = []
+    strings_len = [0]
+
+    def add_string(s):
+        off = strings_len[0]
+        strings.append(s + "\0")
+        strings_len[0] += len(s) + 1
+        return off
+
+    # Most files in a build are compiled with identical arguments so each
+    # distinct argument vector is only stored once
+    argvec_ids = {}
+    argvecs = []
+    slots = [(0, 0, EMPTY_SLOT)] * n_slots
+
+    for src_file in sorted(comp_args):
+        args = tuple(comp_args[src_file])
+        if args not in argvec_ids:
+            off = strings_len[0]
+            for arg in args:
+                add_string(arg)
+            argvec_ids[args] = len(argvecs)
+            argvecs.append((off, len(args)))
+
+        h = path_hash(src_file)
+        idx = h & (n_slots - 1)
+        while slots[idx][2] != EMPTY_SLOT:
+            idx = (idx + 1) & (n_slots - 1)
+        slots[idx] = (h, argvec_ids[args], add_string(src_file))
+
+    slots_off = HEADER.size
+    argvec_off = slots_off + SLOT.size * n_slots
+    strings_off = argvec_off + ARGVEC.size * len(argvecs)
+
+    with open(index_file, "wb") as fd:
+        fd.write(HEADER.pack(MAGIC, len(comp_args), n_slots, len(argvecs),
+                             slots_off, argvec_off, strings_off))
+        for slot in slots:
+            fd.write(SLOT.pack(*slot))
+        for argvec in argvecs:
+            fd.write(ARGVEC.pack(*argvec))
+        fd.write("".join(strings))
+
+    log.info("Indexed %d source files using %d distinct argument lists" % \
+             (len(comp_args), len(argvecs)))
+    return len(comp_args)
+
+class CompiledProjectData(object):
+    """Read only mapping from source file paths to compiler arguments backed
+    by an index file created by compile_project_data. This provides the same
+    interface as the dictionary returned by load_project_data.
+
+    """
+
+    def __init__(self, index_file):
+        with open(index_file, "rb") as fd:
+            self._mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._n_files, self._n_slots, self._n_argvecs, \
+            self._slots_off, self._argvec_off, self._strings_off = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise CompileArgsError("%s is not a compiled index" % index_file)
+
+    def close(self):
+        """Unmap the index file. The mapping cannot be used afterwards."""
+
+        self._mm.close()
+
+    def _string(self, off):
+        start = self._strings_off + off
+        return self._mm[start:self._mm.find("\0", start)]
+
+    def _args(self, argvec_id):
+        off, count = ARGVEC.unpack_from(self._mm,
+            self._argvec_off + argvec_id * ARGVEC.size)
+        args = []
+        for i in xrange(count):
+            arg = self._string(off)
+            off += len(arg) + 1
+            args.append(arg)
+        return args
+
+    def _slots(self):
+        for idx in xrange(self._n_slots):
+            slot = SLOT.unpack_from(self._mm, self._slots_off + idx * SLOT.size)
+            if slot[2] != EMPTY_SLOT:
+                yield slot
+
+    def get(self, src_file, default=None):
+        h = path_hash(src_file)
+        idx = h & (self._n_slots - 1)
+        while True:
+            slot_h, argvec_id, path_off = SLOT.unpack_from(self._mm,
+                self._slots_off + idx * SLOT.size)
+            if path_off == EMPTY_SLOT:
+                return default
+            if slot_h == h and self._string(path_off) == src_file:
+                return self._args(argvec_id)
+            idx = (idx + 1) & (self._n_slots - 1)
+
+    def __getitem__(self, src_file):
+        args = self.get(src_file)
+        if args is None:
+            raise KeyError(src_file)
+        return args
+
+    def __contains__(self, src_file):
+        return self.get(src_file) is not None
+
+    def __len__(self):
+        return self._n_files
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        for slot in self._slots():
+            yield self._string(slot[2])
+
+    def iteritems(self):
+        for slot in self._slots():
+            yield (self._string(slot[2]), self._args(slot[1]))
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+def open_project_data(data_file):
+    """Load the compiler arguments from either a compiled index or the raw
+    output of the compiler wrapper, depending on the type of 'data_file'
+
+    @type data_file: String
+    @param data_file: The compiled index or compiler wrapper log
+
+    @rtype: Dictionary or CompiledProjectData
+    @returns: A mapping from path-to-source-file to a list of compiler args
+
+    """
+
+    if is_compiled_index(data_file):
+        return CompiledProjectData(data_file)
+    return load_project_data(data_file)
+
+def close_project_data(comp_args):
+    """Release the resources held by a mapping returned by open_project_data.
+    Only a CompiledProjectData holds any.
+
+    @type comp_args: Dictionary or CompiledProjectData
+    @param comp_args: The mapping to close
+
+    """
+
+    if isinstance(comp_args, CompiledProjectData):
+        comp_args.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument("-c", dest="cc_log", required=True,
+                      help="The file created by the compiler wrapper")
+    parser.add_argument("-o", dest="index_file", required=True,
+                      help="The name of the index file to create")
+    args = parser.parse_args()
+
+    compile_project_data(args.cc_log, args.index_file)
+    sys.exit(0)
@@ -3,22 +3,38 @@
 """Drop-in replacement for clang. Logs the arguments passed to the compiler to
 the file xxx_compiler_args.out. Set the CC and CXX to point at this script.
 
+Each invocation is logged as a single line containing a JSON record with the
+working directory the compiler was run from, the arguments it was given and
+the values of any environment variables that affect header lookup. Relative
+paths in the arguments can then be resolved correctly no matter where the
+log is later processed from.
+
 """
 
 __author__= "Sean Heelan"
 __email__ = "sean.heelan@gmail.com"
 
+import os
 import sys
+import json
 import subprocess
 
 O_FILE = "xxx_compiler_args.out"
 CC = "clang"
 
+# Environment variables consulted by the compiler when searching for headers
+ENV_VARS = ["CPATH", "C_INCLUDE_PATH", "CPLUS_INCLUDE_PATH"]
+
+record = {
+    "cwd": os.getcwd(),
+    "args": sys.argv[1:],
+    "env": dict((k, os.environ[k]) for k in ENV_VARS if k in os.environ),
+}
+
 with open(O_FILE, "ab") as fd:
-    fd.write(" ".join(sys.argv[1:]) + "\n")
+    fd.write(json.dumps(record) + "\n")
     l = [CC]
     l.extend(sys.argv[1:])
     r = subprocess.Popen(l)
 
 sys.exit(r.wait())
-
@@ -0,0 +1,330 @@
+"""A pool of worker processes that runs jobs and streams back their results in
+the order in which they complete.
+
+Unlike multiprocessing.Pool, only a bounded number of jobs are handed to the
+workers at a time, so a slow consumer applies backpressure to the producer of
+jobs. A worker that dies while running a job (e.g. because libclang crashed)
+is reported as a failure of that job and replaced, rather than hanging the
+pool. The pool can be cancelled at any point, which kills all workers.
+
+Workers can also be recycled after running a given number of jobs or once
+their resident memory passes a limit, so that memory leaked or fragmented
+while running jobs is returned to the system during long runs.
+
+"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import logging
+import traceback
+import collections
+import multiprocessing
+
+# How often, in seconds, the pool checks for dead workers while waiting
+POLL_INTERVAL = 1.0
+
+def current_rss():
+    """Return the resident set size of the calling process in bytes, or None
+    if it cannot be determined on this platform
+
+    """
+
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+class JobResult(object):
+    """The outcome of a single job
+
+    @ivar job: The job as passed to the pool
+    @ivar ok: True if the job completed, False if it raised an exception or
+        killed its worker
+    @ivar value: The return value of the job function if ok is True
+    @ivar error: A description of the failure if ok is False
+
+    """
+
+    def __init__(self, job, ok, value=None, error=None):
+        self.job = job
+        self.ok = ok
+        self.value = value
+        self.error = error
+
+def _worker_loop(func, tasks, results, results_lock, max_jobs, max_rss):
+    """Main loop of a worker process. Runs jobs received on the connection
+    'tasks' until it receives None, or until it has run 'max_jobs' jobs or
+    its resident memory exceeds 'max_rss' bytes.
+
+    Results are sent on the connection 'results', shared by all workers
+    and guarded by 'results_lock', along with whether the worker is about
+    to retire. Unlike a multiprocessing.Queue, which hands the data to a
+    feeder thread, a send has written the result to the pipe by the time it
+    returns. A result can therefore not be lost if the worker dies after
+    sending it.
+
+    """
+
+    log = logging.getLogger("_worker_loop")
+    job_count = 0
+
+    def send(msg):
+        with results_lock:
+            results.send(msg)
+
+    for job_id, job in iter(tasks.recv, None):
+        try:
+            status, value = ("done", func(job))
+        except Exception:
+            status, value = ("failed", traceback.format_exc())
+
+        # The decision to retire is sent with the result, so that the parent
+        # does not hand another job to a worker that is exiting
+        job_count += 1
+        retire = False
+        if max_jobs and job_count >= max_jobs:
+            log.debug("Worker %d retiring after %d jobs" % \
+                      (os.getpid(), job_count))
+            retire = True
+        elif max_rss:
+            rss = current_rss()
+            if rss is not None and rss > max_rss:
+                log.debug("Worker %d retiring with a resident size of %d " \
+                          "bytes" % (os.getpid(), rss))
+                retire = True
+
+        try:
+            send((status, job_id, value, retire))
+        except Exception:
+            # e.g. the value could not be pickled
+            send(("failed", job_id, traceback.format_exc(), retire))
+        if retire:
+            break
+
+class WorkerPool(object):
+    """Run a function over a stream of jobs in a pool of worker processes"""
+
+    def __init__(self, func, workers, max_pending=None, max_jobs=None,
+                 max_rss=None):
+        """
+        @type func: Callable
+        @param func: The function to run for each job. It must be defined at
+            module level and its return value must be picklable.
+
+        @type workers: Integer
+        @param workers: The number of worker processes
+
+        @type max_pending: Integer
+        @param max_pending: The maximum number of jobs taken from the
+            iterable passed to run but not yet consumed. Defaults to twice
+            the number of workers.
+
+        @type max_jobs: Integer
+        @param max_jobs: If set, each worker is replaced by a new process
+            after running this many jobs
+
+        @type max_rss: Integer
+        @param max_rss: If set, a worker is replaced by a new process after
+            any job which leaves its resident memory above this many bytes
+
+        """
+
+        self.func = func
+        self.max_pending = max_pending or 2 * workers
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self._results, self._results_writer = \
+            multiprocessing.Pipe(duplex=False)
+        self._results_lock = multiprocessing.Lock()
+        # Maps each worker process to the connection its jobs are sent on
+        self._workers = {}
+        # Maps each busy worker process to the id of the job it was sent,
+        # or None once it has sent its last result before retiring. Jobs
+        # are handed to a worker one at a time by the parent, so the job a
+        # dead worker was running is always known, even if it died while
+        # receiving it.
+        self._running = {}
+        self._cancelled = False
+
+        for i in range(workers):
+            self._start_worker()
+
+    def _start_worker(self):
+        tasks, tasks_writer = multiprocessing.Pipe(duplex=False)
+        p = multiprocessing.Process(target=_worker_loop,
+                                    args=(self.func, tasks,
+                                          self._results_writer,
+                                          self._results_lock,
+                                          self.max_jobs, self.max_rss))
+        p.start()
+        # Only the worker reads its jobs, so that sending to a dead worker
+        # fails rather than blocking
+        tasks.close()
+        self._workers[p] = tasks_writer
+
+    def _dispatch(self, queued, pending):
+        """Send the jobs with the ids in the deque 'queued' to idle workers,
+        removing them from 'queued'
+
+        """
+
+        for p, tasks in self._workers.items():
+            if not len(queued):
+                break
+            if p in self._running:
+                continue
+
+            job_id = queued.popleft()
+            try:
+                tasks.send((job_id, pending[job_id]))
+            except (IOError, OSError):
+                # The worker has died and is replaced by _reap_dead_workers
+                queued.appendleft(job_id)
+                continue
+            self._running[p] = job_id
+
+    def _receive(self, pending):
+        """Read one message from the workers and return its JobResult, or
+        None if the job has already been reported as lost
+
+        """
+
+        msg, job_id, value, retiring = self._results.recv()
+        for p, running_id in self._running.items():
+            if running_id == job_id:
+                if retiring:
+                    self._running[p] = None
+                else:
+                    del self._running[p]
+                break
+
+        # A worker can die after sending its result, in which case the job
+        # has already been reported as lost
+        job = pending.pop(job_id, None)
+        if job is None:
+            return None
+
+        if msg == "done":
+            return JobResult(job, True, value=value)
+        return JobResult(job, False, error=value)
+
+    def _reap_dead_workers(self, pending):
+        """Replace any workers that have died or retired
+
+        @rtype: List of JobResult
+        @return: The results, including failures for the jobs of the dead
+            workers, that were read while reaping
+
+        """
+
+        log = logging.getLogger("WorkerPool")
+        dead = [p for p in self._workers if not p.is_alive()]
+        if not len(dead):
+            return []
+
+        # A worker has written its results by the time it exits, so reading
+        # them all first leaves only the jobs that were really lost running
+        res = []
+        while self._results.poll():
+            result = self._receive(pending)
+            if result is not None:
+                res.append(result)
+
+        for p in dead:
+            p.join()
+            job_id = self._running.pop(p, None)
+            if p.exitcode == 0 and job_id is None:
+                log.debug("Replacing retired worker %d" % p.pid)
+            else:
+                log.error("Worker %d died with exit code %s" % \
+                          (p.pid, str(p.exitcode)))
+            if job_id is not None and job_id in pending:
+                res.append(JobResult(pending.pop(job_id), False,
+                                     error="Worker process died"))
+            self._workers.pop(p).close()
+            self._start_worker()
+        return res
+
+    def run(self, jobs):
+        """Run the pool's function on each of 'jobs'. This is a generator
+        yielding a JobResult for each job as soon as it completes. Jobs are
+        only taken from 'jobs' as capacity becomes available. If the
+        generator is closed before it is exhausted the pool is cancelled.
+
+        @type jobs: Iterable
+        @param jobs: The jobs to run. Each must be picklable.
+
+        @rtype: Generator of JobResult
+
+        """
+
+        jobs = iter(jobs)
+        pending = {}
+        # The ids of the jobs in pending that are not yet sent to a worker
+        queued = collections.deque()
+        next_job_id = 0
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_pending:
+                    try:
+                        job = jobs.next()
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[next_job_id] = job
+                    queued.append(next_job_id)
+                    next_job_id += 1
+
+                if not len(pending):
+                    break
+
+                # Workers that retired are replaced as soon as possible so
+                # that the pool does not run short of capacity
+                for result in self._reap_dead_workers(pending):
+                    yield result
+
+                self._dispatch(queued, pending)
+
+                if not self._results.poll(POLL_INTERVAL):
+                    continue
+                result = self._receive(pending)
+                if result is not None:
+                    yield result
+        except GeneratorExit:
+            self.cancel()
+            raise
+
+    def cancel(self):
+        """Kill all workers, abandoning any jobs they are running"""
+
+        self._cancelled = True
+        for p in self._workers:
+            p.terminate()
+        for p, tasks in self._workers.items():
+            p.join()
+            tasks.close()
+        self._workers = {}
+        self._running = {}
+
+    def close(self):
+        """Stop the workers once they have finished their current jobs"""
+
+        if self._cancelled:
+            return
+
+        for p, tasks in self._workers.items():
+            try:
+                tasks.send(None)
+            except (IOError, OSError):
+                # The worker has already exited
+                pass
+        for p, tasks in self._workers.items():
+            p.join()
+            tasks.close()
+        self._workers = {}
+        self._running = {}
@@ -78,9 +78,10 @@ SourceRange, SourceLocation, and File
 Known Issues and Limitations
 ============================
 
-* The high-level Indexing component is not implemented. This feature has a lot
-  of moving parts and will take a good amount of effort to implement.
-  Contributions welcome!
+* The high-level Indexing component is only partially implemented. IndexAction
+  exposes the entity references reported by clang_indexSourceFile and
+  clang_indexTranslationUnit. Declarations, includes and the remaining
+  callbacks are not yet exposed. Contributions welcome!
   http://clang.llvm.org/doxygen/group__CINDEX__HIGH.html
 
 * Translation Unit load failures don't expose details. libclang doesn't expose
@@ -193,21 +194,25 @@ from . import enumerations
 
 from ctypes import byref
 from ctypes import c_char_p
+from ctypes import c_double
 from ctypes import c_int
 from ctypes import c_longlong
 from ctypes import c_uint
 from ctypes import c_ulong
+from ctypes import c_ulonglong
 from ctypes import c_void_p
 from ctypes import cast
 from ctypes import cdll
 from ctypes import CFUNCTYPE
 from ctypes import POINTER
 from ctypes import py_object
+from ctypes import sizeof
 from ctypes import Structure
 import collections
 
 import platform
 import warnings
+import weakref
 
 def get_cindex_library(): # pragma: no cover
     """Obtain a reference to the libclang library.
@@ -244,6 +249,10 @@ lib = get_cindex_library()
 # This will hold CFUNCTYPE instances for Python callbacks.
 callbacks = {}
 
+# This will hold second handles on library functions that are registered
+# without an errcheck, for hot paths that want the raw C structures.
+raw_functions = {}
+
 ### Exception Classes ###
 
 class TranslationUnitLoadError(Exception):
@@ -286,6 +295,13 @@ class TranslationUnitSaveError(Exception):
         self.save_error = enumeration
         Exception.__init__(self, 'Error %d: %s' % (enumeration, message))
 
+class IndexingError(Exception):
+    """Represents an error that occurred when indexing a TranslationUnit.
+
+    This is raised when clang_indexTranslationUnit reports a failure.
+    """
+    pass
+
 ### Structures and Utility Classes ###
 
 class CachedProperty(object):
@@ -316,6 +332,90 @@ class CachedProperty(object):
 
         return value
 
+# Marker for values missing from a CursorPropertyCache, as None is a valid
+# property value.
+_MISSING = object()
+
+class CursorPropertyCache(object):
+    """Cache of Cursor property values shared by all Cursors belonging to a
+    TranslationUnit.
+
+    CachedProperty only caches values on a single Cursor instance. The same
+    AST node is often reached through several Cursor instances (e.g. via
+    get_children(), semantic_parent and referenced) and each would otherwise
+    repeat the same libclang calls. Entries here are keyed on the contents of
+    the underlying CXCursor so they are shared by all such instances.
+
+    Cached values must not hold a reference to the TranslationUnit as the
+    resulting reference cycle would keep it alive forever. Properties that
+    return objects tied to a TranslationUnit store the raw structure instead
+    and wrap it on each lookup.
+
+    The cache holds at most max_entries cursors and is emptied when it fills
+    up. It is also emptied when its TranslationUnit is disposed.
+    """
+
+    def __init__(self, max_entries=65536):
+        self.max_entries = max_entries
+        self._entries = {}
+
+    @staticmethod
+    def key(structure):
+        """Return the cache key for the CXCursor structure."""
+        return (structure.kind, structure.xdata, structure.data[0],
+                structure.data[1], structure.data[2])
+
+    def lookup(self, structure, name, default=None):
+        """Return the cached value of property name for the CXCursor."""
+        entry = self._entries.get(CursorPropertyCache.key(structure))
+        if entry is None:
+            return default
+
+        return entry.get(name, default)
+
+    def store(self, structure, name, value):
+        """Cache value as the value of property name for the CXCursor."""
+        key = CursorPropertyCache.key(structure)
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            entry = self._entries[key] = {}
+
+        entry[name] = value
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class TUCachedProperty(CachedProperty):
+    """Decorator that lazy-loads the value of a Cursor property and shares it
+    through the TranslationUnit's CursorPropertyCache.
+
+    The decorated property must return a value that does not reference the
+    TranslationUnit.
+    """
+
+    def __get__(self, instance, instance_type=None):
+        """Called when property is accessed."""
+        if instance is None:
+            return self
+
+        name = self.wrapped.__name__
+        cache = instance._struct.translation_unit.cursor_cache
+
+        value = cache.lookup(instance._struct, name, _MISSING)
+        if value is _MISSING:
+            value = self.wrapped(instance)
+            cache.store(instance._struct, name, value)
+
+        setattr(instance, name, value)
+
+        return value
+
 class ClangContainer(object):
     """An iterable and indexable container for Clang objects.
 
@@ -1226,6 +1326,11 @@ class SourceRange(object):
         """
         return lib.clang_getRangeEnd(self._struct)
 
+    @property
+    def translation_unit(self):
+        """Get the TranslationUnit to which this range belongs."""
+        return getattr(self._struct, 'translation_unit', None)
+
     def __eq__(self, other):
         return lib.clang_equalRanges(self._struct, other._struct)
 
@@ -1440,11 +1545,19 @@ class Cursor(object):
         self._struct.translation_unit = tu
 
     def __eq__(self, other):
+        if not isinstance(other, Cursor):
+            return False
+
         return lib.clang_equalCursors(self._struct, other._struct)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        # Cursors that compare equal have the same clang_hashCursor value,
+        # which allows them to be used as dictionary keys and in sets.
+        return self.hash
+
     def is_null(self):
         """Returns True if this cursor is the special null cursor.
 
@@ -1493,7 +1606,7 @@ class Cursor(object):
         # declaration prior to issuing the lookup.
         return lib.clang_getCursorDefinition(self._struct)
 
-    @CachedProperty
+    @TUCachedProperty
     def usr(self):
         """Return the Unified Symbol Resultion (USR) for the entity referenced
         by the given cursor (or None).
@@ -1535,7 +1648,7 @@ class Cursor(object):
         """
         return lib.clang_getSpecializedCursorTemplate(self._struct)
 
-    @CachedProperty
+    @TUCachedProperty
     def spelling(self):
         """Return the spelling of the entity pointed at by the cursor."""
         if not self.kind.is_declaration():
@@ -1545,7 +1658,7 @@ class Cursor(object):
 
         return lib.clang_getCursorSpelling(self._struct)
 
-    @CachedProperty
+    @TUCachedProperty
     def displayname(self):
         """
         Return the display name for the entity referenced by this cursor.
@@ -1562,7 +1675,13 @@ class Cursor(object):
         Return the source location (the starting character) of the entity
         pointed at by the cursor.
         """
-        return lib.clang_getCursorLocation(self._struct)
+        tu = self._struct.translation_unit
+        structure = tu.cursor_cache.lookup(self._struct, 'location')
+        if structure is None:
+            structure = lib.clang_getCursorLocation(self._struct).from_param()
+            tu.cursor_cache.store(self._struct, 'location', structure)
+
+        return SourceLocation(structure=structure, tu=tu)
 
     @CachedProperty
     def extent(self):
@@ -1570,7 +1689,18 @@ class Cursor(object):
         Return the source range (the range of text) occupied by the entity
         pointed at by the cursor.
         """
-        return lib.clang_getCursorExtent(self._struct)
+        # SourceRange attaches the TranslationUnit to its structure so the
+        # cache holds a detached copy which is copied again for each user.
+        tu = self._struct.translation_unit
+        structure = tu.cursor_cache.lookup(self._struct, 'extent')
+        if structure is None:
+            structure = lib.clang_getCursorExtent(self._struct).from_param()
+            structure = SourceRange.CXSourceRange.from_buffer_copy(structure)
+            tu.cursor_cache.store(self._struct, 'extent', structure)
+
+        return SourceRange(
+                structure=SourceRange.CXSourceRange.from_buffer_copy(structure),
+                tu=tu)
 
     @CachedProperty
     def type(self):
@@ -1732,18 +1862,32 @@ class Cursor(object):
         return File(obj=lib.clang_getIncludedFile(self._struct),
                     tu=self.translation_unit)
 
-    def get_children(self, recurse=False):
+    def get_children(self, recurse=False, in_file=None):
         """Return an iterator for accessing the children of this cursor.
 
         By default, the iterator iterates over Cursor instances that are the
         direct children of the current Cursor. If recurse is True, the iterator
         iterates over all descendents as it visits a cursor. i.e. you will get
         a child, then grandchildren, before moving on to to the next child.
+
+        If in_file is a File then only children whose expansion location is in
+        that file are returned, and children elsewhere are not recursed into.
+        The check compares CXFile pointers before any Python objects are
+        created for the child, so rejecting e.g. the declarations pulled in
+        from headers costs very little.
         """
+        self._struct.translation_unit._check_open()
+
+        file_ptr = None
+        if in_file is not None:
+            file_ptr = in_file.pointer
 
         # FIXME: Expose iteration from CIndex, PR6125.
         def visitor(child, parent, children):
             """Callback executed for each child cursor."""
+            if file_ptr is not None and _cursor_file_pointer(child) != file_ptr:
+                return 1 # continue
+
             cursor = Cursor(structure=child, tu=self._struct.translation_unit)
 
             # FIXME: Document this assertion in API.
@@ -1762,6 +1906,57 @@ class Cursor(object):
                                 children)
         return iter(children)
 
+    def get_num_arguments(self):
+        """Return the number of arguments of a call expression or function
+        declaration, or -1 for any other kind of cursor."""
+        return lib.clang_Cursor_getNumArguments(self._struct)
+
+    def get_argument(self, index):
+        """Return the argument at 'index' of a call expression or function
+        declaration.
+
+        Unlike get_children, only the one requested Cursor is created. The
+        callee of a call expression is not counted as an argument. A null
+        cursor is returned if there is no such argument.
+        """
+        return lib.clang_Cursor_getArgument(self._struct, index)
+
+    def get_arguments(self):
+        """Return an iterator for the arguments of a call expression or
+        function declaration."""
+        for i in range(self.get_num_arguments()):
+            yield self.get_argument(i)
+
+    def evaluate(self):
+        """Evaluate the expression or the initializer of the variable at
+        this cursor as a constant.
+
+        The value is found from the AST rather than the tokens, so it is
+        also available for literals that come from a macro's arguments or
+        from stringizing. An integer, float or string is returned, or None
+        if the cursor cannot be evaluated to one of these.
+        """
+        res = lib.clang_Cursor_Evaluate(self._struct)
+        if not res:
+            return None
+
+        try:
+            kind = lib.clang_EvalResult_getKind(res)
+            if kind == 1:
+                # CXEval_Int
+                if lib.clang_EvalResult_isUnsignedInt(res):
+                    return lib.clang_EvalResult_getAsUnsigned(res)
+                return lib.clang_EvalResult_getAsLongLong(res)
+            if kind == 2:
+                # CXEval_Float
+                return lib.clang_EvalResult_getAsDouble(res)
+            if kind in (3, 4, 5):
+                # CXEval_ObjCStrLiteral, CXEval_StrLiteral and CXEval_CFStr
+                return lib.clang_EvalResult_getAsStr(res)
+            return None
+        finally:
+            lib.clang_EvalResult_dispose(res)
+
     def get_tokens(self):
         """Obtain the Tokens that constitute this token.
 
@@ -1840,6 +2035,7 @@ class Cursor(object):
                 break
 
         assert tu is not None
+        tu._check_open()
 
         return Cursor(structure=res, tu=tu)
 
@@ -1852,6 +2048,19 @@ class Cursor(object):
         warnings.warn('Switch to Cursor() constructor.', DeprecationWarning)
         return Cursor(location=location, tu=tu)
 
+def _cursor_file_pointer(structure):
+    """Return the address of the CXFile containing the expansion location of
+    the CXCursor structure, or None.
+
+    This works on the raw structures so it can be used before a Cursor has
+    been created.
+    """
+    f = c_object_p()
+    location = raw_functions['clang_getCursorLocation'](structure)
+    lib.clang_getExpansionLocation(location, byref(f), None, None, None)
+
+    return cast(f, c_void_p).value
+
 class Type(object):
     """The type of an element in the abstract syntax tree."""
     class CXType(Structure):
@@ -1877,6 +2086,11 @@ class Type(object):
         """Return the kind of this type."""
         return TypeKind.from_value(self._struct.kind_id)
 
+    @CachedProperty
+    def spelling(self):
+        """Return the spelling of this type, e.g. "zval **"."""
+        return lib.clang_getTypeSpelling(self._struct)
+
     def argument_types(self):
         """Retrieve a container for the non-variadic arguments for this type.
 
@@ -2046,6 +2260,7 @@ class Type(object):
                 break
 
         assert tu is not None
+        tu._check_open()
 
         return Type(structure=res, tu=tu)
 
@@ -2347,8 +2562,47 @@ class Index(ClangObject):
         """
         return Index(lib.clang_createIndex(excludeDecls, 0))
 
+    def __init__(self, obj):
+        ClangObject.__init__(self, obj)
+
+        # The TranslationUnits created from this index, which must be
+        # disposed of before it is.
+        self._tus = weakref.WeakSet()
+
     def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def closed(self):
+        """Whether close() has been called on this Index."""
+        return getattr(self, 'obj', None) is None
+
+    def close(self):
+        """Release the native memory held by this Index.
+
+        Any TranslationUnits created from the index that are still open are
+        closed first. Calling close() more than once has no effect.
+        """
+        if self.closed:
+            return
+
+        for tu in list(getattr(self, '_tus', ())):
+            tu.close()
+
         lib.clang_disposeIndex(self)
+        self.obj = self._as_parameter_ = None
+
+    def from_param(self):
+        """ctypes helper to convert the instance to a function argument."""
+        if self.closed:
+            raise ValueError('Operation on a closed Index.')
+        return self._as_parameter_
 
     def read(self, path):
         """Load a TranslationUnit from the given AST file."""
@@ -2515,9 +2769,62 @@ class TranslationUnit(ClangObject):
         # We hold on to a reference to the underlying index so it won't get
         # garbage collected before us.
         self._index = index
+        index._tus.add(self)
+
+        self._cursor_cache = CursorPropertyCache()
 
     def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def closed(self):
+        """Whether close() has been called on this TranslationUnit."""
+        return getattr(self, 'obj', None) is None
+
+    def close(self):
+        """Release the native memory held by this TranslationUnit.
+
+        Cursors, Tokens and other objects derived from the translation unit
+        keep a reference to it but can no longer be used once it is closed.
+        Obtaining a Cursor or Type from it, e.g. through cursor,
+        get_children or a property of an existing Cursor, raises ValueError
+        instead. So that accessing the properties of the AST stays cheap,
+        they are not checked individually, and objects obtained before the
+        translation unit was closed must not be used after it. Calling
+        close() more than once has no effect.
+        """
+        if self.closed:
+            return
+
+        self._cursor_cache.clear()
         lib.clang_disposeTranslationUnit(self)
+        self.obj = self._as_parameter_ = None
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError('Operation on a closed TranslationUnit.')
+
+    @property
+    def index(self):
+        """The Index this TranslationUnit was created from."""
+        return self._index
+
+    def from_param(self):
+        """ctypes helper to convert the instance to a function argument."""
+        self._check_open()
+        return self._as_parameter_
+
+    @property
+    def cursor_cache(self):
+        """The CursorPropertyCache shared by Cursors from this
+        TranslationUnit."""
+        return self._cursor_cache
 
     @property
     def cursor(self):
@@ -2551,6 +2858,25 @@ class TranslationUnit(ClangObject):
                                 includes)
         return iter(includes)
 
+    def first_diagnostic(self, severity=Diagnostic.Error):
+        """Return the first Diagnostic with at least the given severity, or
+        None if there is none.
+
+        Only the severity of the diagnostics passed over is queried; their
+        messages, locations and ranges are never rendered. This makes it a
+        cheap way to check a translation unit for e.g. fatal errors.
+        """
+        self._check_open()
+        for i in range(lib.clang_getNumDiagnostics(self)):
+            ptr = lib.clang_getDiagnostic(self, i)
+            if not ptr:
+                continue
+            # The Diagnostic disposes of ptr once it is collected
+            diag = Diagnostic(ptr, tu=self)
+            if diag.severity >= severity:
+                return diag
+        return None
+
     @property
     def diagnostics(self):
         """The diagnostics for this translation unit.
@@ -2670,6 +2996,8 @@ class TranslationUnit(ClangObject):
         end_location -- SourceLocation at which to finish receiving tokens.
         sourcerange -- SourceRange to fetch tokens from.
         """
+        self._check_open()
+
         use_range = None
         if sourcerange is not None:
             assert(isinstance(sourcerange, SourceRange))
@@ -2792,6 +3120,15 @@ class File(object):
         """Return the TranslationUnit to which this File belongs."""
         return self._tu
 
+    @CachedProperty
+    def pointer(self):
+        """Return the address of the underlying CXFile as an int.
+
+        Within a TranslationUnit each file has a single CXFile, so this can
+        be used to cheaply test whether two locations are in the same file.
+        """
+        return cast(self._obj.obj, c_void_p).value
+
     def from_param(self):
         """ctypes helper to convert the instance to a function argument."""
         return self._obj
@@ -2831,6 +3168,215 @@ class FileInclusion(object):
         """True if the included file is the input file."""
         return self.depth == 0
 
+class EntityReference(object):
+    """A reference to an entity reported by the indexer.
+
+    EntityReference instances are obtained from an IndexAction. The usr and
+    name attributes describe the referenced entity. cursor is the Cursor for
+    the reference itself, location is its SourceLocation and container is the
+    Cursor of the declaration containing the reference (e.g. the function
+    whose body contains a call), or None.
+    """
+
+    # Values of the kind attribute.
+    DIRECT = 1
+    IMPLICIT = 2
+
+    def __init__(self, kind, usr, name, cursor, location, container):
+        self.kind = kind
+        self.usr = usr
+        self.name = name
+        self.cursor = cursor
+        self.location = location
+        self.container = container
+
+    def __repr__(self):
+        return "<EntityReference %r, location %r>" % (self.usr, self.location)
+
+class IndexAction(ClangObject):
+    """Drives libclang's high-level indexer.
+
+    The indexer walks a translation unit in native code and reports events
+    through callbacks, which is considerably cheaper than visiting every
+    Cursor from Python. Currently only entity references are exposed.
+
+    IndexAction instances should be created with IndexAction.create(). As
+    for Index, the native memory is released by close(), or on leaving a
+    with block.
+    """
+
+    # Index options. These are a bitwise or of CXIndexOptFlags values.
+    INDEX_NONE = 0
+    INDEX_SUPPRESS_REDUNDANT_REFS = 1
+    INDEX_FUNCTION_LOCAL_SYMBOLS = 2
+    INDEX_IMPLICIT_TEMPLATE_INSTANTIATIONS = 4
+    INDEX_SUPPRESS_WARNINGS = 8
+    INDEX_SKIP_PARSED_BODIES_IN_SESSION = 16
+
+    @staticmethod
+    def create(index=None):
+        """Create a new IndexAction.
+
+        index is the Index instance to utilize. If not provided, a new Index
+        will be created, which is closed along with the action.
+        """
+        owns_index = index is None
+        if owns_index:
+            index = Index.create()
+
+        return IndexAction(lib.clang_IndexAction_create(index), index,
+                           owns_index)
+
+    def __init__(self, ptr, index, owns_index=False):
+        assert isinstance(index, Index)
+
+        ClangObject.__init__(self, ptr)
+
+        # The action must not outlive the index it was created from.
+        self._index = index
+        self._owns_index = owns_index
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def closed(self):
+        """Whether close() has been called on this IndexAction."""
+        return getattr(self, 'obj', None) is None
+
+    def close(self):
+        """Release the native memory held by this IndexAction.
+
+        The Index is also closed if it was created by create(). Calling
+        close() more than once has no effect.
+        """
+        if self.closed:
+            return
+
+        lib.clang_IndexAction_dispose(self)
+        self.obj = self._as_parameter_ = None
+        if self._owns_index:
+            self._index.close()
+
+    def from_param(self):
+        """ctypes helper to convert the instance to a function argument."""
+        if self.closed:
+            raise ValueError('Operation on a closed IndexAction.')
+        return self._as_parameter_
+
+    @staticmethod
+    def _callbacks(usrs, refs):
+        """Build the IndexerCallbacks used to collect entity references.
+
+        References are stored in refs as raw structures as the Cursors
+        passed to the callback are only valid for its duration and, when
+        indexing a source file, the TranslationUnit does not yet exist.
+        References to entities whose USR is not in usrs are dropped without
+        being copied.
+        """
+        def entity_reference(client_data, info):
+            """Callback executed for each entity reference."""
+            info = info.contents
+            if not info.entity:
+                return
+
+            entity = info.entity.contents
+            if usrs is not None and entity.usr not in usrs:
+                return
+
+            container = None
+            if info.container:
+                container = CXCursor.from_buffer_copy(
+                        info.container.contents.cursor)
+
+            location = lib.clang_indexLoc_getCXSourceLocation(info.location)
+            refs.append((info.kind, entity.usr, entity.name,
+                         CXCursor.from_buffer_copy(info.cursor), location,
+                         container))
+
+        index_callbacks = IndexerCallbacks()
+        index_callbacks.entity_reference = \
+                callbacks['indexer_entity_reference'](entity_reference)
+        return index_callbacks
+
+    @staticmethod
+    def _wrap_references(refs, tu):
+        """Generator converting raw references into EntityReference
+        instances belonging to tu."""
+        for kind, usr, name, cursor, location, container in refs:
+            if container is not None:
+                container = Cursor(structure=container, tu=tu)
+            yield EntityReference(kind, usr, name,
+                                  Cursor(structure=cursor, tu=tu),
+                                  SourceLocation(structure=location, tu=tu),
+                                  container)
+
+    def index_translation_unit(self, tu, usrs=None, options=0):
+        """Index an already parsed TranslationUnit.
+
+        usrs is an optional collection of USRs. If provided, only references
+        to entities with one of these USRs are reported.
+
+        options is a bitwise or of IndexAction.INDEX_XXX flags.
+
+        This returns an iterator of EntityReference instances. If indexing
+        fails an IndexingError is raised.
+        """
+        assert isinstance(tu, TranslationUnit)
+
+        if usrs is not None:
+            usrs = frozenset(usrs)
+
+        refs = []
+        index_callbacks = IndexAction._callbacks(usrs, refs)
+        result = lib.clang_indexTranslationUnit(self, refs,
+                byref(index_callbacks), sizeof(IndexerCallbacks), options, tu)
+        if result != 0:
+            raise IndexingError("Error indexing translation unit.")
+
+        return IndexAction._wrap_references(refs, tu)
+
+    def index_source_file(self, filename, args=None, usrs=None, options=0,
+                          tu_options=0):
+        """Parse and index a source file.
+
+        args, usrs and options are as for TranslationUnit.from_source() and
+        index_translation_unit(). tu_options is a bitwise or of
+        TranslationUnit.PARSE_XXX flags.
+
+        This returns a 2-tuple of the parsed TranslationUnit and an iterator
+        of EntityReference instances. If the file could not be parsed a
+        TranslationUnitLoadError is raised.
+        """
+        if args is None:
+            args = []
+
+        if usrs is not None:
+            usrs = frozenset(usrs)
+
+        args_array = None
+        if len(args) > 0:
+            args_array = (c_char_p * len(args))(* args)
+
+        refs = []
+        index_callbacks = IndexAction._callbacks(usrs, refs)
+        ptr = c_object_p()
+        lib.clang_indexSourceFile(self, refs, byref(index_callbacks),
+                                  sizeof(IndexerCallbacks), options, filename,
+                                  args_array, len(args), None, 0, byref(ptr),
+                                  tu_options)
+        if not ptr:
+            raise TranslationUnitLoadError("Error parsing translation unit.")
+
+        tu = TranslationUnit(ptr, index=self._index)
+        return (tu, IndexAction._wrap_references(refs, tu))
+
 # Now comes the plumbing to hook up the C library.
 
 # Register callback types in common container.
@@ -2838,8 +3384,9 @@ callbacks['translation_unit_includes'] = CFUNCTYPE(None, c_object_p,
         POINTER(SourceLocation.CXSourceLocation), c_uint, py_object)
 callbacks['cursor_visit'] = CFUNCTYPE(c_int, CXCursor, CXCursor, py_object)
 callbacks['indexer_abort_query'] = CFUNCTYPE(c_int, py_object, c_void_p)
-#callbacks['indexer_diagnostic'] = CFUNCTYPE(None, py_object,
-#        CXDiagnosticSet, c_void_p)
+# CXDiagnosticSet is not yet wrapped so it is passed as an opaque pointer.
+callbacks['indexer_diagnostic'] = CFUNCTYPE(None, py_object, c_void_p,
+        c_void_p)
 callbacks['indexer_entered_main_file'] = CFUNCTYPE(c_object_p,
         py_object, CXFile, c_void_p)
 callbacks['indexer_included_file'] = CFUNCTYPE(c_object_p, py_object,
@@ -2847,11 +3394,28 @@ callbacks['indexer_included_file'] = CFUNCTYPE(c_object_p, py_object,
 callbacks['indexer_imported_ast_file'] = CFUNCTYPE(c_object_p,
         py_object, POINTER(CXIdxImportedASTFileInfo))
 callbacks['indexer_started_tu'] = CFUNCTYPE(c_object_p, py_object, c_void_p)
-callbacks['indxer_declaration'] = CFUNCTYPE(None, py_object,
+callbacks['indexer_declaration'] = CFUNCTYPE(None, py_object,
         POINTER(CXIdxDeclInfo))
 callbacks['indexer_entity_reference'] = CFUNCTYPE(None, py_object,
         POINTER(CXIdxEntityRefInfo))
 
+class IndexerCallbacks(Structure):
+    """Represents an IndexerCallbacks struct.
+
+    Callbacks that are not set are passed to libclang as NULL and the
+    corresponding events are not reported.
+    """
+    _fields_ = [
+        ('abort_query', callbacks['indexer_abort_query']),
+        ('diagnostic', callbacks['indexer_diagnostic']),
+        ('entered_main_file', callbacks['indexer_entered_main_file']),
+        ('included_file', callbacks['indexer_included_file']),
+        ('imported_ast_file', callbacks['indexer_imported_ast_file']),
+        ('started_tu', callbacks['indexer_started_tu']),
+        ('declaration', callbacks['indexer_declaration']),
+        ('entity_reference', callbacks['indexer_entity_reference'])
+    ]
+
 def register_functions(lib):
     """Register function prototypes with a libclang library instance.
 
@@ -2879,6 +3443,16 @@ def register_functions(lib):
     lib.clang_createTranslationUnit.argtypes = [Index, c_char_p]
     lib.clang_createTranslationUnit.restype = c_object_p
 
+    lib.clang_Cursor_Evaluate.argtypes = [CXCursor]
+    lib.clang_Cursor_Evaluate.restype = c_void_p
+
+    lib.clang_Cursor_getArgument.argtypes = [CXCursor, c_uint]
+    lib.clang_Cursor_getArgument.restype = CXCursor
+    lib.clang_Cursor_getArgument.errcheck = Cursor.from_struct
+
+    lib.clang_Cursor_getNumArguments.argtypes = [CXCursor]
+    lib.clang_Cursor_getNumArguments.restype = c_int
+
     lib.clang_Cursor_isNull.argtypes = [CXCursor]
     lib.clang_Cursor_isNull.restype = bool
 
@@ -2920,6 +3494,26 @@ def register_functions(lib):
     lib.clang_equalTypes.argtypes = [Type.CXType, Type.CXType]
     lib.clang_equalTypes.restype = bool
 
+    lib.clang_EvalResult_dispose.argtypes = [c_void_p]
+
+    lib.clang_EvalResult_getAsDouble.argtypes = [c_void_p]
+    lib.clang_EvalResult_getAsDouble.restype = c_double
+
+    lib.clang_EvalResult_getAsLongLong.argtypes = [c_void_p]
+    lib.clang_EvalResult_getAsLongLong.restype = c_longlong
+
+    lib.clang_EvalResult_getAsStr.argtypes = [c_void_p]
+    lib.clang_EvalResult_getAsStr.restype = c_char_p
+
+    lib.clang_EvalResult_getAsUnsigned.argtypes = [c_void_p]
+    lib.clang_EvalResult_getAsUnsigned.restype = c_ulonglong
+
+    lib.clang_EvalResult_getKind.argtypes = [c_void_p]
+    lib.clang_EvalResult_getKind.restype = c_int
+
+    lib.clang_EvalResult_isUnsignedInt.argtypes = [c_void_p]
+    lib.clang_EvalResult_isUnsignedInt.restype = bool
+
     lib.clang_getArgType.argtypes = [Type.CXType, c_uint]
     lib.clang_getArgType.restype = Type.CXType
     lib.clang_getArgType.errcheck = Type.from_struct
@@ -2983,6 +3577,13 @@ def register_functions(lib):
     lib.clang_getCursorLocation.restype = SourceLocation.CXSourceLocation
     lib.clang_getCursorLocation.errcheck = SourceLocation.from_struct
 
+    # Indexing the library returns a new function object, so this can be
+    # registered without the errcheck above.
+    raw_functions['clang_getCursorLocation'] = lib['clang_getCursorLocation']
+    raw_functions['clang_getCursorLocation'].argtypes = [CXCursor]
+    raw_functions['clang_getCursorLocation'].restype = \
+            SourceLocation.CXSourceLocation
+
     lib.clang_getCursorReferenced.argtypes = [CXCursor]
     lib.clang_getCursorReferenced.restype = CXCursor
     lib.clang_getCursorReferenced.errcheck = Cursor.from_struct
@@ -3201,9 +3802,33 @@ def register_functions(lib):
     lib.clang_getTypeKindSpelling.restype = CXString
     lib.clang_getTypeKindSpelling.errcheck = CXString.from_result
 
+    lib.clang_getTypeSpelling.argtypes = [Type.CXType]
+    lib.clang_getTypeSpelling.restype = CXString
+    lib.clang_getTypeSpelling.errcheck = CXString.from_result
+
     lib.clang_hashCursor.argtypes = [CXCursor]
     lib.clang_hashCursor.restype = c_uint
 
+    lib.clang_IndexAction_create.argtypes = [Index]
+    lib.clang_IndexAction_create.restype = c_object_p
+
+    lib.clang_IndexAction_dispose.argtypes = [IndexAction]
+
+    lib.clang_indexLoc_getCXSourceLocation.argtypes = [CXIdxLoc]
+    lib.clang_indexLoc_getCXSourceLocation.restype = \
+            SourceLocation.CXSourceLocation
+    # errcheck omitted because the TranslationUnit may not exist yet when
+    # this is called from an indexer callback.
+
+    lib.clang_indexSourceFile.argtypes = [IndexAction, py_object,
+            POINTER(IndexerCallbacks), c_uint, c_uint, c_char_p, c_void_p,
+            c_int, c_void_p, c_uint, POINTER(c_object_p), c_uint]
+    lib.clang_indexSourceFile.restype = c_int
+
+    lib.clang_indexTranslationUnit.argtypes = [IndexAction, py_object,
+            POINTER(IndexerCallbacks), c_uint, c_uint, TranslationUnit]
+    lib.clang_indexTranslationUnit.restype = c_int
+
     lib.clang_isAttribute.argtypes = [CursorKind]
     lib.clang_isAttribute.restype = bool
 
@@ -3315,9 +3940,12 @@ __all__ = [
     'Cursor',
     'CXXAccessSpecifier',
     'Diagnostic',
+    'EntityReference',
     'File',
     'FixIt',
     'Index',
+    'IndexAction',
+    'IndexingError',
     'SourceLocation',
     'SourceRange',
     'Token',
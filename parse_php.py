@@ -18,22 +18,103 @@ libclang_bindings folder
 __author__= "Sean Heelan"
 __email__ = "sean.heelan@gmail.com"
 
+import os
 import sys
+import json
+import mmap
+import hashlib
+import shutil
+import random
 import logging
 import argparse
+import tempfile
+import itertools
+import multiprocessing
 
 from Queue import Queue
 
 import clang.cindex as clang
 
-from interparser.ccargparse import load_project_data
+from interparser.ccindex import open_project_data, close_project_data
+from interparser.jobs import WorkerPool
+from interparser.shards import parse_shard, in_shard, project_root
+from interparser.symbols import SymbolIndex, index_symbols
+from interparser.pipeline import FormatRecord, FunctionEntry, has_format, \
+        filter_records, dedup_records, group_by_function, RecordWriter, \
+        write_function_entries, collect_format_strings, join_function_entries
 
 ZEND_FUNC = "zend_parse_parameters"
+ZEND_FUNC_USR = "c:@F@%s" % ZEND_FUNC
 DESC = "Format string extractor for %s" % ZEND_FUNC
 
-# Counter for the number of calls to ZEND_FUNC detected that use a
-# variable rather than a string literal as their argument
-VAR_ARG_COUNT = 0
+# Identifiers whose presence in the source text of a file or function
+# indicates that it may call ZEND_FUNC. With the pre-screen and the prefilter,
+# files and functions mentioning none of them are not parsed or traversed.
+# Macros such as zend_parse_parameters_none are matched by the ZEND_FUNC
+# prefix. Calls made through other wrapper macros or aliases are missed
+# unless the wrappers are added with --wrapper_macro.
+TARGET_IDENTIFIERS = [ZEND_FUNC]
+
+# The macros delimiting the "Fast ZPP" parameter parsing API used instead of
+# ZEND_FUNC by most functions since PHP 7. ZEND_PARSE_PARAMETERS_START_EX is
+# matched by the prefix.
+FAST_ZPP_START = "ZEND_PARSE_PARAMETERS_START"
+FAST_ZPP_END = "ZEND_PARSE_PARAMETERS_END"
+
+# Maps the Z_PARAM_* macros of the Fast ZPP API to the equivalent ZEND_FUNC
+# format string specifiers. The _OR_NULL, _EX and _EX2 variants of each are
+# handled by fast_zpp_fmt_str.
+Z_PARAM_SPECS = {
+    "Z_PARAM_OPTIONAL" : "|",
+    "Z_PARAM_ARRAY" : "a",
+    "Z_PARAM_ARRAY_HT" : "h",
+    "Z_PARAM_ARRAY_OR_OBJECT" : "A",
+    "Z_PARAM_ARRAY_OR_OBJECT_HT" : "H",
+    "Z_PARAM_BOOL" : "b",
+    "Z_PARAM_CLASS" : "C",
+    "Z_PARAM_DOUBLE" : "d",
+    "Z_PARAM_FUNC" : "f",
+    "Z_PARAM_LONG" : "l",
+    "Z_PARAM_STRICT_LONG" : "L",
+    "Z_PARAM_NUMBER" : "n",
+    "Z_PARAM_OBJECT" : "o",
+    "Z_PARAM_OBJ" : "o",
+    "Z_PARAM_OBJECT_OF_CLASS" : "O",
+    "Z_PARAM_OBJ_OF_CLASS" : "O",
+    "Z_PARAM_PATH" : "p",
+    "Z_PARAM_PATH_STR" : "P",
+    "Z_PARAM_RESOURCE" : "r",
+    "Z_PARAM_STRING" : "s",
+    "Z_PARAM_STR" : "S",
+    "Z_PARAM_ZVAL" : "z",
+    "Z_PARAM_ZVAL_DEREF" : "z",
+    "Z_PARAM_VARIADIC_WITH_NAMED" : "*",
+}
+
+# Expression kinds that wrap a single operand without changing its value,
+# such as implicit conversions, parentheses and casts
+TRANSPARENT_EXPR_KINDS = frozenset([clang.CursorKind.UNEXPOSED_EXPR,
+                                    clang.CursorKind.PAREN_EXPR,
+                                    clang.CursorKind.CSTYLE_CAST_EXPR])
+
+# Prefixes of the C functions generated by the PHP_FUNCTION and PHP_METHOD
+# macros
+PHP_FUNC_PREFIXES = ("zif_", "zim_")
+
+# libclang parse flags that may be enabled for the extraction pass from the
+# command line
+PARSE_FLAGS = {
+    "incomplete" : clang.TranslationUnit.PARSE_INCOMPLETE,
+    "detailed_record" : clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD,
+}
+
+# Parse flags for the optional declarations only pass which is used to find
+# the files that define PHP functions before they are fully parsed
+DECLS_PASS_OPTIONS = clang.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES | \
+        clang.TranslationUnit.PARSE_INCOMPLETE
+
+# The HeaderCache used by extract_file in this process, created on first use
+HEADER_CACHE = None
 
 class FunctionProcessingError(Exception):
     pass
@@ -41,113 +122,1053 @@ class FunctionProcessingError(Exception):
 class VariableArgumentError(Exception):
     pass
 
-def get_child(node, idx):
-    """Return child number 'idx' of the AST cursor 'node'
+class CalleeMatcher(object):
+    """Identifies calls to a set of target functions by the USR of the
+    declaration the call refers to, rather than by the spelling at the call
+    site. This also matches calls made through macros. The result for each
+    distinct callee declaration is cached, so USR strings are only
+    materialised once per callee rather than once per call. A matcher should
+    only be used with cursors from a single translation unit.
 
-    @type node: clang.cindex.Cursor
-    @param node: The node to process
+    """
+
+    def __init__(self, target_usrs):
+        """
+        @type target_usrs: List of Strings
+        @param target_usrs: The USRs of the functions to match calls to
+
+        """
+
+        self.target_usrs = frozenset(target_usrs)
+        # Maps callee cursors to whether they are a target
+        self._cache = {}
+
+    def is_target(self, call_cursor):
+        """Check if the CALL_EXPR 'call_cursor' calls a target function
+
+        @type call_cursor: clang.cindex.Cursor
+        @param call_cursor: The function call to check
+
+        @rtype: Boolean
+
+        """
+
+        callee = call_cursor.referenced
+        if callee.is_null():
+            # e.g. calls through a function pointer
+            return False
+
+        res = self._cache.get(callee)
+        if res is None:
+            res = self._cache[callee] = callee.usr in self.target_usrs
+        return res
+
+class FormatResolver(object):
+    """Recovers the candidate values of a format string argument that is not
+    a string literal, e.g. one chosen with the conditional operator, held in
+    a variable or taken from a static array of literals. Variables are
+    followed to their initializer only; later assignments are not seen. The
+    values of each declaration are cached, so a constant shared by many
+    functions is resolved once. A resolver should only be used with cursors
+    from a single translation unit.
+
+    """
+
+    def __init__(self):
+        # Maps declaration cursors to their candidate values, or None if
+        # they could not be resolved
+        self._cache = {}
+
+    def resolve(self, expr):
+        """Return the string literals that the expression 'expr' may
+        evaluate to
+
+        @type expr: clang.cindex.Cursor
+        @param expr: The expression to resolve
+
+        @rtype: List of Strings
+        @return: The candidate values, or None if any branch of the
+            expression could not be resolved to a literal
+
+        """
+
+        expr = strip_expr(expr)
+        if expr.kind == clang.CursorKind.STRING_LITERAL:
+            fmt_str = literal_value(expr)
+            if fmt_str is None:
+                return None
+            return [fmt_str]
+
+        if expr.kind == clang.CursorKind.DECL_REF_EXPR:
+            return self.resolve_decl(expr.referenced)
+
+        children = list(expr.get_children())
+        if expr.kind == clang.CursorKind.CONDITONAL_OPERATOR and \
+                len(children) == 3:
+            true_vals = self.resolve(children[1])
+            false_vals = self.resolve(children[2])
+            if true_vals is None or false_vals is None:
+                return None
+            return true_vals + [v for v in false_vals if v not in true_vals]
+
+        if expr.kind == clang.CursorKind.ARRAY_SUBSCRIPT_EXPR and \
+                len(children) == 2:
+            # Without evaluating the index any element may be chosen
+            vals = self.resolve(children[0])
+            if vals is None:
+                return None
+            index = integer_value(strip_expr(children[1]))
+            if index is not None and 0 <= index < len(vals):
+                return [vals[index]]
+            return vals
+
+        if expr.kind == clang.CursorKind.INIT_LIST_EXPR:
+            vals = []
+            for c in children:
+                c_vals = self.resolve(c)
+                if c_vals is None:
+                    return None
+                vals.extend(c_vals)
+            return vals
+
+        return None
+
+    def resolve_decl(self, decl):
+        """Return the string literals the variable declared by 'decl' may
+        hold according to its initializer. For an array of literals all of
+        its elements are returned, in order.
+
+        @type decl: clang.cindex.Cursor
+        @param decl: The declaration to resolve
+
+        @rtype: List of Strings
+        @return: The candidate values, or None if they could not be found
+
+        """
+
+        if decl is None or decl.is_null() or \
+                decl.kind != clang.CursorKind.VAR_DECL:
+            return None
+
+        if decl in self._cache:
+            return self._cache[decl]
+
+        # Guards against a declaration referring to itself
+        self._cache[decl] = None
+
+        children = list(decl.get_children())
+        vals = None
+        if len(children) and children[-1].kind.is_expression():
+            vals = self.resolve(children[-1])
+
+        self._cache[decl] = vals
+        return vals
+
+class HeaderCache(object):
+    """Records the headers whose functions have already been extracted, so
+    that the functions defined in a header (e.g. static inline helpers) are
+    extracted from only the first translation unit that includes it. A
+    header is identified by its path, a hash of its contents and the macros
+    defined on the command line of the translation unit, as these decide
+    which of its functions are compiled. The macros defined by the files
+    included before it are not taken into account.
+
+    """
+
+    def __init__(self, prescreen=False):
+        # If set then headers rejected by file_may_call are not extracted
+        self._prescreen = prescreen
+        # The (path, content hash, macros) keys of the headers extracted
+        self._done = set()
+        # Maps each path to its (mtime, size) when last read and the hash
+        # of its contents and result of file_may_call at that time
+        self._files = {}
+
+    def _file_info(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        info = self._files.get(path)
+        if info is None or info[0] != (st.st_mtime, st.st_size):
+            with open(path, "rb") as fd:
+                digest = hashlib.sha1(fd.read()).hexdigest()
+            info = self._files[path] = ((st.st_mtime, st.st_size), digest,
+                                        file_may_call(path))
+            if self._prescreen and not info[2]:
+                log = logging.getLogger("HeaderCache")
+                log.info("Skipping the functions of %s as it does not " \
+                         "mention %s" % (path, ZEND_FUNC))
+        return info
+
+    def claim(self, path, macros):
+        """Check if the functions of the header at 'path' need extracting,
+        which is the case if they have not been extracted under the same
+        macros before and, with the pre-screen, the header may parse
+        parameters. If so the header is recorded as extracted.
+
+        @type path: String
+        @param path: The header
+
+        @type macros: Tuple of Strings
+        @param macros: The macro state, as returned by macro_state
+
+        @rtype: Boolean
+
+        """
+
+        info = self._file_info(path)
+        if info is None or (self._prescreen and not info[2]):
+            return False
+
+        key = (path, info[1], macros)
+        if key in self._done:
+            return False
+        self._done.add(key)
+        return True
+
+def macro_state(args):
+    """Return the -D and -U options in the compiler arguments 'args', in
+    order, which together decide the macros defined before any file is
+    included
+
+    @type args: List of Strings
+    @param args: The arguments passed to the compiler
+
+    @rtype: Tuple of Strings
+
+    """
+
+    res = []
+    args = list(args)
+    for idx, arg in enumerate(args):
+        if arg in ("-D", "-U") and idx + 1 < len(args):
+            res.append(arg + args[idx + 1])
+        elif arg.startswith(("-D", "-U")) and len(arg) > 2:
+            res.append(arg)
+    return tuple(res)
+
+def strip_expr(expr):
+    """Strip any implicit conversions, parentheses and casts from around the
+    expression 'expr'
+
+    @type expr: clang.cindex.Cursor
+    @param expr: The expression to strip
+
+    @rtype: clang.cindex.Cursor
+    @return: The first expression under 'expr' that is not of one of the
+        TRANSPARENT_EXPR_KINDS, or an UNEXPOSED_EXPR that has more than one
+        operand
+
+    """
+
+    while expr.kind in TRANSPARENT_EXPR_KINDS:
+        # A cast's children include a reference to the type cast to
+        operands = [c for c in expr.get_children() if c.kind.is_expression()]
+        if len(operands) != 1:
+            break
+        expr = operands[0]
+
+    return expr
+
+def call_argument(call_cursor, idx):
+    """Return the expression passed as argument number 'idx' of a call,
+    stripped by strip_expr
+
+    @type call_cursor: clang.cindex.Cursor
+    @param call_cursor: The CALL_EXPR
 
     @type idx: Integer
-    @param idx: The index of the child to return
+    @param idx: The index of the argument, not counting the callee
 
-    @rtype: clang.cinde.Cursor
+    @rtype: clang.cindex.Cursor
+    @return: The argument or None if the call has too few arguments
 
     """
 
-    return list(node.get_children())[idx]
+    arg = call_cursor.get_argument(idx)
+    if arg is None or arg.is_null():
+        return None
+    return strip_expr(arg)
 
-def extract_fmt_str(func_call_nodes):
-    """Extact the format string from a call to ZEND_FUNC
+def out_param_types(call_cursor):
+    """Return the types of the arguments of a call to ZEND_FUNC that receive
+    the parsed parameters, i.e. those after the format string
 
-    @type func_call_nodes: List of clang.cindex.Cursor
-    @param func_call_nodes: A list of the AST nodes for the function call
+    @type call_cursor: clang.cindex.Cursor
+    @param call_cursor: The CALL_EXPR for the function call
 
-    @rtype: String
-    @return: The format string parameter to the call
+    @rtype: List of Strings
+    @return: The spelling of the type of each argument as passed, e.g.
+        "zval **". This is the type after any casts in the argument, so
+        unlike call_argument the argument is not stripped.
 
     """
 
-    # The format string is the child of an UNEXPOSED_EXPR introduced due to
-    # an rvalue-to-lvalue conversion
-    unex_expr = get_child(func_call_nodes[2], 0)
-    tkn_container = get_child(unex_expr, 0)
+    types = []
+    for idx in range(2, call_cursor.get_num_arguments()):
+        arg = call_cursor.get_argument(idx)
+        if arg is None or arg.is_null():
+            types.append(None)
+        else:
+            types.append(arg.type.spelling)
+    return types
 
-    if tkn_container.kind != clang.CursorKind.STRING_LITERAL:
-        raise VariableArgumentError()
+def leading_literals(tokens):
+    """Return the values of the string literal tokens at the start of
+    'tokens', without their quotation marks
+
+    @type tokens: Iterable of clang.cindex.Token
+
+    @rtype: List of Strings
+
+    """
+
+    parts = []
+    for t in tokens:
+        if t is None or t.kind != clang.TokenKind.LITERAL or \
+                not t.spelling.startswith('"'):
+            break
+        parts.append(t.spelling[1:-1])
+    return parts
+
+def spelled_tokens(tkn_container):
+    """Return the tokens of the cursor 'tkn_container' where its text is
+    spelled. For an expression expanded from a macro this is inside the
+    macro's definition, whereas its extent covers the macro's name.
+
+    @rtype: Iterable of clang.cindex.Token
+    @return: The tokens, which may be followed by others, or an empty list
+        if the cursor's text is not in a file
+
+    """
+
+    extent = tkn_container.extent
+    try:
+        start = extent.start.spelling_location
+        end = extent.end.spelling_location
+    except Exception:
+        # e.g. a location in the predefines buffer
+        return []
+
+    if start[0].name != end[0].name or end[3] < start[3]:
+        end = start
+
+    return tkn_container.translation_unit.get_tokens(
+        start_location=clang.SourceLocation(source=start[0], offset=start[3]),
+        end_location=clang.SourceLocation(source=end[0], offset=end[3]))
+
+def literal_value(tkn_container):
+    """Return the value of the STRING_LITERAL cursor 'tkn_container'
+
+    @rtype: String
+    @return: The value of the literal or None if it cannot be recovered
+
+    """
+
+    # Evaluating the literal finds its value even where its tokens are not
+    # in a file, e.g. a name stringized by ZEND_ARG_INFO's #name
+    value = tkn_container.evaluate()
+    if isinstance(value, str):
+        return value
 
     tokens = list(tkn_container.get_tokens())
-    if tokens[0] is None:
+    if not tokens or tokens[0] is None:
         return ""
 
-    # Strip the quotation marks as we get the string literal
-    fmt_str = tokens[0].spelling[1:-1]
+    # Adjacent literals are concatenated. Tokenizing an extent can return
+    # the token following it, so only the leading literals are used.
+    parts = leading_literals(tokens)
+    if len(parts):
+        return "".join(parts)
 
-    return fmt_str
+    # The extent of a literal expanded from a macro, e.g. #define FMT "sl",
+    # covers the macro's name instead
+    parts = leading_literals(spelled_tokens(tkn_container))
+    if len(parts):
+        return "".join(parts)
+    return None
 
-def process_function(func_cursor):
-    """Search the function indicated by 'func_cursor' for the all calls to
-    zend_parse_parameters. Return all format strings used by such invocations.
+def integer_value(tkn_container):
+    """Return the value of the integer constant expression 'tkn_container',
+    such as an INTEGER_LITERAL
 
-    @type func_cursor: clang.cindex.Cursor
-    @param func_cursor: A cursor object for the function to prcoess
+    @rtype: Integer
+    @return: The value of the expression or None if 'tkn_container' is not
+        an integer constant or its value cannot be recovered
+
+    """
+
+    # Evaluating the expression finds its value where it is a macro's
+    # argument, e.g. the required_num_args of ZEND_BEGIN_ARG_INFO_EX, and
+    # the extent of the literal covers the macro's name
+    value = tkn_container.evaluate()
+    if isinstance(value, (int, long)):
+        return value
+
+    if tkn_container.kind != clang.CursorKind.INTEGER_LITERAL:
+        return None
+
+    tokens = list(tkn_container.get_tokens())
+    if not tokens or tokens[0] is None:
+        return None
+
+    try:
+        return int(tokens[0].spelling.rstrip("uUlL"), 0)
+    except ValueError:
+        # e.g. the extent of a literal expanded from a macro
+        return None
+
+def extract_fmt_str(call_cursor, resolver=None):
+    """Extact the format string from a call to ZEND_FUNC
+
+    @type call_cursor: clang.cindex.Cursor
+    @param call_cursor: The CALL_EXPR for the function call
+
+    @type resolver: FormatResolver
+    @param resolver: If given, used to find the candidate values of a
+        format string that is not a string literal
 
     @rtype: List of Strings
-    @return: A list of all unique format strings used as arguments to
-        ZEND_FUNC within the specified function
+    @return: The possible values of the format string parameter to the call.
+        There is only more than one if it is chosen at runtime.
+
+    """
+
+    # The format string follows the number of arguments
+    arg = call_argument(call_cursor, 1)
+    if arg is None:
+        raise VariableArgumentError()
+
+    fmt_strs = None
+    if arg.kind == clang.CursorKind.STRING_LITERAL:
+        fmt_str = literal_value(arg)
+        if fmt_str is not None:
+            fmt_strs = [fmt_str]
+    elif resolver is not None:
+        fmt_strs = resolver.resolve(arg)
+
+    if not fmt_strs:
+        raise VariableArgumentError()
+
+    return fmt_strs
+
+def map_source_file(path):
+    """Map the contents of the file at 'path' into memory
+
+    @type path: String
+    @param path: The file to map
+
+    @rtype: mmap.mmap
+    @return: A read only mapping of the file or None if it is empty
+
+    """
+
+    with open(path, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+def file_may_call(path):
+    """Cheaply check if the source file at 'path' may contain a call to
+    ZEND_FUNC or a use of the Fast ZPP API by searching its raw contents for
+    any of TARGET_IDENTIFIERS or FAST_ZPP_START
+
+    @type path: String
+    @param path: The source file to check
+
+    @rtype: Boolean
+    @return: False if the file does not parse any parameters, unless it
+        does so through a macro defined elsewhere
+
+    """
+
+    src_map = map_source_file(path)
+    if src_map is None:
+        return False
+
+    try:
+        for ident in TARGET_IDENTIFIERS + [FAST_ZPP_START]:
+            if src_map.find(ident) != -1:
+                return True
+    finally:
+        src_map.close()
+
+    return False
+
+def function_may_call(src_map, func_cursor):
+    """Cheaply check if the function indicated by 'func_cursor' may contain a
+    call to ZEND_FUNC by searching the raw source text of the function for
+    any of TARGET_IDENTIFIERS
+
+    @type src_map: mmap.mmap
+    @param src_map: The contents of the file containing the function
+
+    @type func_cursor: clang.cindex.Cursor
+    @param func_cursor: A cursor object for the function to check
+
+    @rtype: Boolean
+    @return: False if the function definitely does not call ZEND_FUNC
+
+    """
+
+    extent = func_cursor.extent
+    start = extent.start.offset
+    end = extent.end.offset
+
+    for ident in TARGET_IDENTIFIERS:
+        if src_map.find(ident, start, end) != -1:
+            return True
+
+    return False
+
+def is_macro_expansion(main_file, offset):
+    """Check if a macro is expanded at 'offset' in 'main_file', as opposed to
+    its name appearing in a comment or in code excluded by the preprocessor
+
+    @type main_file: clang.cindex.File
+    @param main_file: The file containing the macro name
+
+    @type offset: Integer
+    @param offset: The file offset of the start of the macro name
+
+    @rtype: Boolean
+
+    """
+
+    cursor = clang.Cursor(location=clang.SourceLocation(source=main_file,
+                                                        offset=offset))
+    if cursor.kind == clang.CursorKind.MACRO_INSTANTIATION:
+        return True
+
+    # Without a detailed preprocessing record there is no cursor for the
+    # expansion itself, but the statements expanded from the macro begin at
+    # its name. Nothing in the AST begins inside a comment or excluded code.
+    return cursor.extent.start.offset == offset
+
+def find_fast_zpp_blocks(src_map, main_file, func_cursor):
+    """Find the ZEND_PARSE_PARAMETERS_START ... ZEND_PARSE_PARAMETERS_END
+    blocks in the source text of the function indicated by 'func_cursor'.
+    A block is only accepted if its ZEND_PARSE_PARAMETERS_START is actually
+    expanded, so those in comments, #if 0 regions and inactive #ifdef
+    branches are ignored. The block is taken to end at the next
+    ZEND_PARSE_PARAMETERS_END in the source text, even if that is in a
+    comment.
+
+    @type src_map: mmap.mmap
+    @param src_map: The contents of the file containing the function
+
+    @type main_file: clang.cindex.File
+    @param main_file: The file containing the function
+
+    @type func_cursor: clang.cindex.Cursor
+    @param func_cursor: A cursor object for the function to search
+
+    @rtype: List of Tuples of (Integer, Integer)
+    @return: The start and end file offsets of each block
+
+    """
+
+    extent = func_cursor.extent
+    pos = extent.start.offset
+    end = extent.end.offset
+
+    blocks = []
+    while True:
+        start = src_map.find(FAST_ZPP_START, pos, end)
+        if start == -1:
+            break
+        if not is_macro_expansion(main_file, start):
+            pos = start + len(FAST_ZPP_START)
+            continue
+        block_end = src_map.find(FAST_ZPP_END, start, end)
+        if block_end == -1:
+            break
+        pos = block_end + len(FAST_ZPP_END)
+        blocks.append((start, pos))
+
+    return blocks
+
+def fast_zpp_fmt_str(spellings):
+    """Reconstruct the ZEND_FUNC format string equivalent to a Fast ZPP block
+
+    @type spellings: List of Strings
+    @param spellings: The spellings of the tokens from the start of the
+        ZEND_PARSE_PARAMETERS_START macro to the ZEND_PARSE_PARAMETERS_END
+        macro, excluding comments
+
+    @rtype: String
+
+    """
+
+    log = logging.getLogger("fast_zpp_fmt_str")
+
+    fmt_str = []
+    idx = 0
+    while idx < len(spellings):
+        name = spellings[idx]
+        idx += 1
+        if not name.startswith("Z_PARAM_"):
+            continue
+
+        # Split the macro's arguments on the commas at the top level
+        args = []
+        if idx < len(spellings) and spellings[idx] == "(":
+            depth = 0
+            for tkn in spellings[idx:]:
+                idx += 1
+                if tkn in ("(", "[", "{"):
+                    depth += 1
+                    if depth == 1:
+                        args.append([])
+                        continue
+                elif tkn in (")", "]", "}"):
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif tkn == "," and depth == 1:
+                    args.append([])
+                    continue
+                args[-1].append(tkn)
+
+        check_null = separate = False
+        if name.endswith("_OR_NULL"):
+            name = name[:-len("_OR_NULL")]
+            check_null = True
+        elif name.endswith("_EX2") and len(args) >= 4:
+            # (dest, ..., check_null, deref, separate)
+            name = name[:-len("_EX2")]
+            check_null = args[-3] in (["1"], ["true"])
+            separate = args[-1] in (["1"], ["true"])
+        elif name.endswith("_EX") and len(args) >= 3:
+            # (dest, ..., check_null, separate)
+            name = name[:-len("_EX")]
+            check_null = args[-2] in (["1"], ["true"])
+            separate = args[-1] in (["1"], ["true"])
+
+        if name == "Z_PARAM_VARIADIC":
+            # The first argument is the specifier as a character literal
+            spec = "*"
+            if len(args) and len(args[0]):
+                spec = args[0][0].strip("'")
+        elif name in Z_PARAM_SPECS:
+            spec = Z_PARAM_SPECS[name]
+        else:
+            # e.g. the union types added in PHP 8, for which ZEND_FUNC has
+            # no specifier. The closest is a plain zval.
+            log.debug("No format specifier for %s" % name)
+            spec = "z"
+
+        fmt_str.append(spec)
+        if check_null:
+            fmt_str.append("!")
+        if separate:
+            fmt_str.append("/")
+
+    return "".join(fmt_str)
+
+def iter_fast_zpp_records(main_file, func_cursor, blocks, src_file=None):
+    """Yield a FormatRecord for each Fast ZPP block in a function, giving the
+    equivalent ZEND_FUNC format string. Only the tokens of the blocks
+    themselves are retrieved from libclang. The out parameter fields of the
+    records are left unknown.
+
+    @type main_file: clang.cindex.File
+    @param main_file: The file containing the function
+
+    @type func_cursor: clang.cindex.Cursor
+    @param func_cursor: A cursor object for the function
+
+    @type blocks: List of Tuples of (Integer, Integer)
+    @param blocks: The blocks found by find_fast_zpp_blocks
+
+    @type src_file: String
+    @param src_file: The file name to use in the records
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    tu = main_file.translation_unit
+    for start, end in blocks:
+        extent = clang.SourceRange(
+            start=clang.SourceLocation(source=main_file, offset=start),
+            end=clang.SourceLocation(source=main_file, offset=end))
+        tokens = [t for t in tu.get_tokens(sourcerange=extent)
+                  if t is not None and t.kind != clang.TokenKind.COMMENT]
+        if not len(tokens) or \
+                not tokens[0].spelling.startswith(FAST_ZPP_START):
+            # The text was matched inside a comment or a string
+            continue
+
+        location = tokens[0].location
+        yield FormatRecord(src_file, func_cursor.spelling,
+                           fast_zpp_fmt_str([t.spelling for t in tokens]),
+                           location.line, location.column)
+
+def decode_php_name(c_name, entries=None):
+    """Decode the name of the C function generated by the PHP_FUNCTION or
+    PHP_METHOD macro into the name of the PHP function or method. Without a
+    function entry table the class and method name of a PHP_METHOD cannot be
+    told apart if the class name contains an underscore, so the class name
+    is taken to end at the first one.
+
+    @type c_name: String
+    @param c_name: The name of the C function, e.g. zim_Class_method
+
+    @type entries: Dict
+    @param entries: A mapping of C function names to (class, name) pairs
+        from function_entries, consulted first
+
+    @rtype: Tuple of (String, String)
+    @return: The class (None for functions) and the function or method
+        name, or None if c_name is not a PHP function or method
+
+    """
+
+    if entries and c_name in entries:
+        return entries[c_name]
+
+    if c_name.startswith("zif_"):
+        return (None, c_name[4:])
+
+    if c_name.startswith("zim_"):
+        class_name, sep, method = c_name[4:].partition("_")
+        if sep and len(class_name) and len(method):
+            return (class_name, method)
+
+    return None
+
+def entry_php_name(name, handler):
+    """Find the class of the entry 'name' of a function entry table from the
+    name of its handler, as generated by the PHP_FE or PHP_ME macro
+
+    @type name: String
+    @param name: The PHP name given in the entry
+
+    @type handler: String
+    @param handler: The name of the C function handling the entry
+
+    @rtype: Tuple of (String, String)
+    @return: The class (None for functions) and name, or None if the
+        handler was not named after the entry, e.g. for an alias
+
+    """
+
+    if handler == "zif_" + name:
+        return (None, name)
+    if handler.startswith("zim_") and handler.endswith("_" + name) \
+            and len(handler) > len(name) + 5:
+        return (handler[4:-len(name) - 1], name)
+    return None
+
+def read_arg_info(decl):
+    """Read the argument names and the number of required arguments from
+    an arginfo array, as declared with the ZEND_BEGIN_ARG_INFO and
+    ZEND_ARG_INFO macros
+
+    @type decl: clang.cindex.Cursor
+    @param decl: The VAR_DECL of the array
+
+    @rtype: Tuple of (List of Strings, Integer)
+    @return: The names of the arguments and the number that are required.
+        The number is None if it could not be read.
+
+    """
+
+    names = []
+    required = None
+
+    children = list(decl.get_children())
+    if not len(children):
+        return (names, required)
+
+    init = strip_expr(children[-1])
+    if init.kind != clang.CursorKind.INIT_LIST_EXPR:
+        return (names, required)
+
+    for idx, elem in enumerate(init.get_children()):
+        elem = strip_expr(elem)
+        if elem.kind != clang.CursorKind.INIT_LIST_EXPR:
+            continue
+        fields = [strip_expr(f) for f in elem.get_children()]
+        if not len(fields):
+            continue
+
+        if idx == 0:
+            # The header element holds the number of required arguments,
+            # cast to the type of the name field from PHP 7 onwards
+            if "zend_internal_arg_info" in decl.type.spelling:
+                required = integer_value(fields[0])
+            elif len(fields) > 3:
+                required = integer_value(fields[3])
+        elif fields[0].kind == clang.CursorKind.STRING_LITERAL:
+            names.append(literal_value(fields[0]))
+
+    return (names, required)
+
+def read_function_table(table_decl, src_file=None, arg_info_cache=None):
+    """Read a zend_function_entry table, as declared with the PHP_FE,
+    PHP_ME and related macros, along with the arginfo of each entry. Since
+    each entry gives the PHP name of the function separately from the C
+    function handling it, the class name can usually be found exactly. For
+    aliases it is decoded from the handler's name by decode_php_name.
+
+    @type table_decl: clang.cindex.Cursor
+    @param table_decl: The VAR_DECL of the table
+
+    @type src_file: String
+    @param src_file: The file name to record in each entry
+
+    @type arg_info_cache: Dict
+    @param arg_info_cache: A mapping of arginfo declarations to the results
+        of read_arg_info, shared between the tables of a translation unit
+        since one arginfo is often given for several entries
+
+    @rtype: List of FunctionEntry
+
+    """
+
+    res = []
+    if arg_info_cache is None:
+        arg_info_cache = {}
+
+    children = list(table_decl.get_children())
+    if not len(children):
+        return res
+
+    init = strip_expr(children[-1])
+    if init.kind != clang.CursorKind.INIT_LIST_EXPR:
+        return res
+
+    for entry in init.get_children():
+        entry = strip_expr(entry)
+        if entry.kind != clang.CursorKind.INIT_LIST_EXPR:
+            continue
+
+        fields = [strip_expr(f) for f in entry.get_children()]
+        if len(fields) < 2 or \
+                fields[0].kind != clang.CursorKind.STRING_LITERAL or \
+                fields[1].kind != clang.CursorKind.DECL_REF_EXPR:
+            # e.g. the terminating PHP_FE_END entry
+            continue
+
+        name = literal_value(fields[0])
+        handler = fields[1].spelling
+        if not name:
+            continue
+
+        php_name = entry_php_name(name, handler)
+        if php_name is None:
+            # An alias, which is registered in the class, if any, of the
+            # function it aliases
+            decoded = decode_php_name(handler)
+            php_name = (decoded[0] if decoded else None, name)
+
+        arg_names = required = None
+        if len(fields) > 2 and \
+                fields[2].kind == clang.CursorKind.DECL_REF_EXPR:
+            arg_decl = fields[2].referenced
+            if arg_decl is not None and not arg_decl.is_null() and \
+                    arg_decl.kind == clang.CursorKind.VAR_DECL:
+                if arg_decl not in arg_info_cache:
+                    arg_info_cache[arg_decl] = read_arg_info(arg_decl)
+                arg_names, required = arg_info_cache[arg_decl]
+
+        res.append(FunctionEntry(src_file, table_decl.spelling, php_name[0],
+                                 php_name[1], handler, arg_names, required))
+
+    return res
+
+def function_entries(table_decl):
+    """Read a zend_function_entry table and return the PHP name of each
+    handler that is named after its entry, i.e. excluding aliases. See
+    read_function_table.
+
+    @type table_decl: clang.cindex.Cursor
+    @param table_decl: The VAR_DECL of the table
+
+    @rtype: Dict
+    @return: A mapping of C function names to (class, name) pairs, where
+        class is None for functions
 
     """
 
-    log = logging.getLogger("process_function")
+    return php_names(read_function_table(table_decl))
 
-    fmt_strs = set()
+def php_names(entries):
+    """Map the handler of each of 'entries' that is not an alias to its
+    (class, name) pair, for use with decode_php_name
+
+    @type entries: Iterable of FunctionEntry
+
+    @rtype: Dict
+
+    """
+
+    res = {}
+    for entry in entries:
+        if entry_php_name(entry.php_name, entry.handler) is not None:
+            res[entry.handler] = (entry.php_class, entry.php_name)
+    return res
+
+def table_files(tu, main_file):
+    """Return the files of 'tu' that may declare function entry tables:
+    'main_file' and any generated arginfo headers (e.g. foo_arginfo.h, as
+    written by PHP 8's gen_stub.php) that it includes directly
+
+    @type tu: clang.cindex.TranslationUnit
+    @param tu: The top level translation unit for a file
+
+    @type main_file: clang.cindex.File
+    @param main_file: The main file of the translation unit
+
+    @rtype: List of clang.cindex.File
+
+    """
+
+    res = [main_file]
+    for inc in tu.get_includes():
+        if inc.depth == 1 and inc.include.name.endswith("_arginfo.h"):
+            res.append(inc.include)
+    return res
+
+def find_function_entries(children, src_file=None):
+    """Read every function entry table among the top level cursors
+    'children' of a translation unit
+
+    @type children: Iterable of clang.cindex.Cursor
+
+    @type src_file: String
+    @param src_file: The file name to record in each entry
+
+    @rtype: List of FunctionEntry
+
+    """
+
+    res = []
+    arg_info_cache = {}
+    for c in children:
+        if c.kind == clang.CursorKind.VAR_DECL and \
+                "zend_function_entry" in c.type.spelling:
+            res.extend(read_function_table(c, src_file, arg_info_cache))
+    return res
+
+def find_calling_functions(tu):
+    """Use libclang's indexer to find the functions in 'tu' that contain a
+    reference to ZEND_FUNC, without visiting every cursor from Python
+
+    @type tu: clang.cindex.TranslationUnit
+    @param tu: The top level translation unit for a file
+
+    @rtype: Set of Strings
+    @return: The names of the functions containing references to ZEND_FUNC
+
+    """
+
+    # The action is created from the translation unit's own index and
+    # released as soon as the references are read
+    with clang.IndexAction.create(tu.index) as action:
+        refs = action.index_translation_unit(tu, usrs=[ZEND_FUNC_USR])
+        return set(r.container.spelling for r in refs
+                   if r.container is not None)
+
+def iter_function_records(func_cursor, matcher=None, src_file=None,
+                          resolver=None):
+    """Search the function indicated by 'func_cursor' for all calls to
+    ZEND_FUNC, yielding a FormatRecord for each as it is found. A call whose
+    format string is chosen at runtime from several literals is yielded once
+    for each. Calls that pass a format string which cannot be resolved are
+    yielded with a fmt_str of None.
+
+    @type func_cursor: clang.cindex.Cursor
+    @param func_cursor: A cursor object for the function to process
+
+    @type matcher: CalleeMatcher
+    @param matcher: Used to identify calls to ZEND_FUNC. Sharing a matcher
+        between the functions of a translation unit shares its cache.
+
+    @type src_file: String
+    @param src_file: The file name to use in the records
+
+    @type resolver: FormatResolver
+    @param resolver: Used to resolve format strings that are not string
+        literals. Sharing a resolver between the functions of a translation
+        unit shares its cache.
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    if matcher is None:
+        matcher = CalleeMatcher([ZEND_FUNC_USR])
+    if resolver is None:
+        resolver = FormatResolver()
+
+    func_name = func_cursor.spelling
     to_process = Queue()
     to_process.put(func_cursor)
 
     while not to_process.empty():
         n = to_process.get()
 
-        if n.kind == clang.CursorKind.CALL_EXPR:
-            # The first child will be the function name, the rest will
-            # represent the arguments to the function. Each child will
-            # be of the kind UNEXPOSED_EXPR due to the function-to-pointer
-            # decay on the function and rvalue-to-lvalue conversion on
-            # the arguments. Each will have a single child of kind
-            # DECL_REF_EXPR from which we can retrieve details such as
-            # the variable name.
-            unexposed_exprs = list(n.get_children())
-            func_name_node = get_child(unexposed_exprs[0], 0)
-            if func_name_node.displayname == ZEND_FUNC:
-                try:
-                    fmt_str = extract_fmt_str(unexposed_exprs)
-                except VariableArgumentError:
-                    # A negligible number of calls to ZEND_FUNC pass the
-                    # format string using a variable.
-                    global VAR_ARG_COUNT
-                    VAR_ARG_COUNT += 1
-                else:
-                    # Some calls to ZEND_FUNC have an empty format string
-                    if len(fmt_str):
-                        fmt_strs.add(fmt_str)
-                # Regardless of our success/failure at retrieving the
-                # format string arg we 1) Don't explore the children
-                # of the CALL node and 2) Do explore the rest of the
-                # function in case there are multiple calls to ZEND_FUNC
-                # with different arguments (e.g. the levenshtein function).
-                continue
+        if n.kind == clang.CursorKind.CALL_EXPR and matcher.is_target(n):
+            try:
+                fmt_strs = extract_fmt_str(n, resolver)
+            except VariableArgumentError:
+                # A small number of calls to ZEND_FUNC pass the format
+                # string using a variable we cannot resolve.
+                fmt_strs = [None]
+
+            location = n.location
+            types = out_param_types(n)
+            for fmt_str in fmt_strs:
+                yield FormatRecord(src_file, func_name, fmt_str,
+                                   location.line, location.column,
+                                   len(types), types)
+            # Regardless of our success/failure at retrieving the
+            # format string arg we 1) Don't explore the children
+            # of the CALL node and 2) Do explore the rest of the
+            # function in case there are multiple calls to ZEND_FUNC
+            # with different arguments (e.g. the levenshtein function).
+            continue
 
         for c in n.get_children():
             to_process.put(c)
 
+def process_function(func_cursor, matcher=None):
+    """Search the function indicated by 'func_cursor' for the all calls to
+    zend_parse_parameters. Return all format strings used by such invocations.
+
+    @type func_cursor: clang.cindex.Cursor
+    @param func_cursor: A cursor object for the function to prcoess
+
+    @type matcher: CalleeMatcher
+    @param matcher: See iter_function_records
+
+    @rtype: List of Strings
+    @return: A list of all unique format strings used as arguments to
+        ZEND_FUNC within the specified function
+
+    """
+
+    records = iter_function_records(func_cursor, matcher)
+    records = dedup_records(filter_records(records, has_format))
+    fmt_strs = [r.fmt_str for r in records]
+
     if len(fmt_strs):
-        return list(fmt_strs)
+        return fmt_strs
     else:
         return None
 
-def process_all_functions(tu, file_filter=None, globals_only=False):
+def iter_records(tu, file_filter=None, globals_only=False, prefilter=False,
+                 use_indexer=False, partition=None, entries_out=None,
+                 callers=None, entries=None):
     """Iterate over the translation unit tu, searching for functions that call
-    ZEND_FUNC. When a call is found the format string used is extracted. A
-    map of each calling function to the format strings used in all calls to
-    ZEND_FUNC is returned.
+    ZEND_FUNC. A FormatRecord is yielded for each call as it is found, with
+    the records of each function yielded together. If file_filter is set, a
+    record is also yielded for each block of Fast ZPP macros.
 
     @type tu: clang.cindex.TranslationUnit
     @param tu: The top level translation unit for a file
@@ -159,131 +1180,890 @@ def process_all_functions(tu, file_filter=None, globals_only=False):
         which we will restrict our processing. If it is None then
         we will process all children of the translation unit.
 
-    @rtype: Dict
+    @type prefilter: Boolean
+    @param prefilter: If True, and file_filter is set, then functions whose
+        source text does not mention any of TARGET_IDENTIFIERS are not
+        traversed. Their Fast ZPP blocks are still processed. This is
+        ignored with use_indexer, which finds the callers exactly.
+
+    @type use_indexer: Boolean
+    @param use_indexer: If True then libclang's indexer is used to find the
+        functions that reference ZEND_FUNC and only those, along with any
+        functions using Fast ZPP, are processed.
+
+    @type partition: Tuple of (Integer, Integer)
+    @param partition: A (part, count) pair. If given then the FUNCTION_DECL
+        children of the translation unit are dealt round robin into 'count'
+        parts and only those in part number 'part' are processed.
+
+    @type entries_out: List
+    @param entries_out: If given then a FunctionEntry for each entry of the
+        function entry tables in the translation unit (or, if file_filter is
+        set, in that file and the arginfo headers it includes) is appended
+        to this list. This is done before any records are yielded.
+
+    @type callers: Set of Strings
+    @param callers: The functions referencing ZEND_FUNC, as found by
+        find_calling_functions. If given then they are used instead of
+        running the indexer again.
+
+    @type entries: Dict
+    @param entries: The PHP names of the handlers of the function entry
+        tables, as returned by php_names. If given then the tables are not
+        read again and entries_out is ignored.
+
+    @rtype: Generator of FormatRecord
 
     """
 
-    log = logging.getLogger("process_all_functions")
-    res = {}
+    log = logging.getLogger("iter_records")
+
+    # The source text is needed to find Fast ZPP blocks as well as for the
+    # prefilter
+    src_map = main_file = None
+    if file_filter:
+        src_map = map_source_file(file_filter)
+        if src_map is None:
+            return
+        main_file = clang.File(filename=file_filter, tu=tu)
+
+    if use_indexer and callers is None:
+        callers = find_calling_functions(tu)
+    # The function entry tables are still wanted from such a file
+    if callers is not None and not len(callers) and entries_out is None and \
+            (src_map is None or src_map.find(FAST_ZPP_START) == -1):
+        if src_map is not None:
+            src_map.close()
+        return
+
+    matcher = CalleeMatcher([ZEND_FUNC_USR])
+    resolver = FormatResolver()
+
+    if file_filter:
+        # Most top level cursors are declarations from headers. They are
+        # rejected by comparing file pointers, before a Cursor is created.
+        children = list(tu.cursor.get_children(in_file=main_file))
+    else:
+        children = list(tu.cursor.get_children())
+
+    # Function entry tables usually follow the functions they list, so they
+    # are read before any records are produced
+    if entries is None:
+        tables = children
+        if file_filter and file_filter == tu.spelling:
+            # Only the arginfo headers of the main file are searched, not
+            # those of a header being processed by iter_header_records
+            tables = list(itertools.chain(children, *[
+                tu.cursor.get_children(in_file=f)
+                for f in table_files(tu, main_file)[1:]]))
+        file_entries = find_function_entries(tables, file_filter)
+        entries = php_names(file_entries)
+        if entries_out is not None:
+            entries_out.extend(file_entries)
+
+    func_idx = -1
+    try:
+        for c in children:
+            if c.kind != clang.CursorKind.FUNCTION_DECL:
+                continue
 
-    for c in tu.cursor.get_children():
-        if c.kind == clang.CursorKind.FUNCTION_DECL:
-            f = c.location.file
-            if file_filter and f.name != file_filter:
+            func_idx += 1
+            if partition and func_idx % partition[1] != partition[0]:
                 continue
 
-            if globals_only and not c.spelling.startswith("zif_"):
+            php_name = decode_php_name(c.spelling, entries)
+            if globals_only and (php_name is None or
+                                 php_name[0] is not None):
                 # Exclude functions that are not defined using the
                 # PHP_FUNCTION macro
                 continue
 
-            log.debug("Processing function %s in %s (%d:%d)" % \
-                (c.spelling, f.name, c.location.line, c.location.column))
+            zpp_blocks = []
+            if src_map is not None:
+                zpp_blocks = find_fast_zpp_blocks(src_map, main_file, c)
 
-            # Check if the function contains a call to zend_parse_parameters
-            fmt_strs = process_function(c)
-            if fmt_strs is None:
-                log.debug("%s does not call %s" % (c.spelling, ZEND_FUNC))
-                continue
+            if callers is not None:
+                # The indexer sees calls made through macros, which the
+                # search of the source text would not
+                may_call = c.spelling in callers
+            elif prefilter and src_map is not None:
+                may_call = function_may_call(src_map, c)
             else:
-                tmp = ", ".join(fmt_strs)
-                log.debug("%s calls %s with the format string(s) %s" % \
-                         (c.spelling, ZEND_FUNC, tmp))
-                res[c.spelling] = fmt_strs
-    return res
+                may_call = True
+
+            if not may_call and not len(zpp_blocks):
+                continue
+
+            log.debug("Processing function %s (%d:%d)" % \
+                (c.spelling, c.location.line, c.location.column))
+
+            records = iter_fast_zpp_records(main_file, c, zpp_blocks,
+                                            file_filter)
+            if may_call:
+                records = itertools.chain(records,
+                    iter_function_records(c, matcher, file_filter, resolver))
+
+            usr = c.usr
+            for record in records:
+                if php_name is not None:
+                    record = record._replace(php_class=php_name[0],
+                                             php_name=php_name[1], usr=usr)
+                else:
+                    record = record._replace(usr=usr)
+                yield record
+    finally:
+        if src_map is not None:
+            src_map.close()
+
+def iter_header_records(tu, macros, headers, globals_only=False,
+                        prefilter=False):
+    """Yield the records for the functions defined in the headers included
+    by 'tu' that have not already been extracted according to 'headers'.
+    If 'headers' was created with the pre-screen then headers whose source
+    text does not mention any of TARGET_IDENTIFIERS or FAST_ZPP_START are
+    not traversed.
+
+    @type tu: clang.cindex.TranslationUnit
+    @param tu: The top level translation unit for a file
+
+    @type macros: Tuple of Strings
+    @param macros: The macro state of the translation unit, as returned by
+        macro_state
+
+    @type headers: HeaderCache
+    @param headers: The headers already extracted, which is updated with
+        those extracted now
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    log = logging.getLogger("iter_header_records")
+
+    seen = set()
+    for inc in tu.get_includes():
+        header = inc.include.name
+        if header in seen:
+            continue
+        seen.add(header)
 
-def write_output(src_file, data, out_file):
-    """Log the function/format string mappings extracted from 'src_file'
+        if not headers.claim(os.path.realpath(header), macros):
+            continue
+
+        log.debug("Processing the functions defined in %s" % header)
+        # The indexer is not used since it would index the whole
+        # translation unit again for each header
+        for record in iter_records(tu, header, globals_only, prefilter):
+            yield record
+
+def process_all_functions(tu, file_filter=None, globals_only=False,
+                          prefilter=False, use_indexer=False, partition=None):
+    """Return a map of each function in 'tu' that calls ZEND_FUNC to the
+    format strings used in those calls. See iter_records for the parameters.
+
+    @rtype: Dict
+
+    """
+
+    records = iter_records(tu, file_filter, globals_only, prefilter,
+                           use_indexer, partition)
+    return group_by_function(dedup_records(filter_records(records,
+                                                          has_format)))
+
+def defines_php_functions(tu, file_filter, globals_only=False):
+    """Check if any function generated by the PHP_FUNCTION (or, unless
+    globals_only is set, PHP_METHOD) macro is defined in 'file_filter'. The
+    translation unit may have been parsed with function bodies skipped.
+
+    @type tu: clang.cindex.TranslationUnit
+    @param tu: The top level translation unit for a file
+
+    @type file_filter: String
+    @param file_filter: The file in which the definitions must appear
+
+    @rtype: Boolean
+
+    """
+
+    prefixes = PHP_FUNC_PREFIXES[:1] if globals_only else PHP_FUNC_PREFIXES
+    main_file = clang.File(filename=file_filter, tu=tu)
+
+    for c in tu.cursor.get_children(in_file=main_file):
+        if c.kind != clang.CursorKind.FUNCTION_DECL:
+            continue
+        if c.spelling.startswith(prefixes) and c.is_definition():
+            return True
+
+    return False
+
+def count_functions(tu, file_filter):
+    """Return the number of FUNCTION_DECL children of 'tu' in 'file_filter'"""
+
+    main_file = clang.File(filename=file_filter, tu=tu)
+    return len([c for c in tu.cursor.get_children(in_file=main_file)
+                if c.kind == clang.CursorKind.FUNCTION_DECL])
+
+def process_partition(job):
+    """Process one partition of the functions in a saved translation unit.
+    This is run in a worker process by iter_records_parallel.
+
+    @type job: Tuple
+    @param job: The path of the saved AST followed by the file_filter,
+        globals_only, prefilter, callers, entries and partition arguments
+        of iter_records
+
+    @rtype: List of FormatRecord
+    @return: The records for the partition
+
+    """
+
+    (ast_file, file_filter, globals_only, prefilter, callers, entries,
+     part) = job
+
+    with clang.Index.create() as index:
+        tu = clang.TranslationUnit.from_ast_file(ast_file, index)
+        return list(iter_records(tu, file_filter, globals_only, prefilter,
+                                 partition=part, callers=callers,
+                                 entries=entries))
+
+def iter_records_parallel(tu, file_filter, jobs, globals_only=False,
+                          prefilter=False, use_indexer=False,
+                          entries_out=None):
+    """As iter_records, but the functions of 'tu' are split between 'jobs'
+    worker processes which each load a saved copy of the AST. This prevents
+    a single huge translation unit (e.g. an amalgamated build of sqlite3.c)
+    from being processed by a single core. The passes over the whole
+    translation unit, reading the function entry tables and running the
+    indexer, are made once in the calling process and their results given
+    to the workers. The records of each partition are yielded as it
+    completes.
+
+    @type jobs: Integer
+    @param jobs: The number of worker processes to use
+
+    @type entries_out: List
+    @param entries_out: As for iter_records. The function entry tables are
+        read in the calling process.
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    log = logging.getLogger("iter_records_parallel")
+
+    tmp_dir = tempfile.mkdtemp(prefix="parse_php")
+    try:
+        ast_file = os.path.join(tmp_dir, "tu.ast")
+        try:
+            tu.save(ast_file)
+        except clang.TranslationUnitSaveError, e:
+            log.warning("Could not save the AST of %s (%s). Processing " \
+                        "it serially." % (file_filter, str(e)))
+            for record in iter_records(tu, file_filter, globals_only,
+                                       prefilter, use_indexer,
+                                       entries_out=entries_out):
+                yield record
+            return
+
+        main_file = clang.File(filename=file_filter, tu=tu)
+        tables = itertools.chain(*[tu.cursor.get_children(in_file=f)
+                                   for f in table_files(tu, main_file)])
+        file_entries = find_function_entries(tables, file_filter)
+        if entries_out is not None:
+            entries_out.extend(file_entries)
+
+        entries = php_names(file_entries)
+        callers = None
+        if use_indexer:
+            callers = find_calling_functions(tu)
+
+        job_list = [(ast_file, file_filter, globals_only, prefilter, callers,
+                     entries, (i, jobs)) for i in range(jobs)]
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for part_records in pool.imap_unordered(process_partition,
+                                                    job_list):
+                for record in part_records:
+                    yield record
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def first_fatal_error(tu):
+    """Cheaply check 'tu' for a fatal error, e.g. a missing header, after
+    which libclang returns an incomplete AST. See
+    clang.TranslationUnit.first_diagnostic.
+
+    @type tu: clang.cindex.TranslationUnit
+    @param tu: The translation unit to check
+
+    @rtype: String
+    @return: The location and message of the first fatal error, or None if
+        there was none
+
+    """
+
+    diag = tu.first_diagnostic(clang.Diagnostic.Fatal)
+    if diag is None:
+        return None
+
+    location = diag.location
+    if location.file is None:
+        return diag.spelling
+    return "%s:%d:%d: %s" % (location.file.name, location.line,
+                             location.column, diag.spelling)
+
+def iter_file_records(src_file, args, globals_only=False, prefilter=False,
+                      parse_options=0, decls_pass=False, use_indexer=False,
+                      split_jobs=1, split_threshold=1000, entries_out=None,
+                      headers=None, triage=False, retry_args=None,
+                      triage_out=None):
+    """Parse 'src_file' and yield a FormatRecord for each call to ZEND_FUNC
+    in the functions defined in it. See iter_records.
 
     @type src_file: String
-    @param src_file: The C/C++ source file from which the data was extracted
+    @param src_file: The C/C++ source file to process
 
-    @type data: Dict
-    @param data: A mapping of function names to format strings used within
-        those functions as parameters to ZEND_FUNC
+    @type args: List of Strings
+    @param args: The arguments passed to the compiler for src_file
 
-    @type out_file: String
-    @param out_file: The log file to which the data will be appended
+    @type parse_options: Integer
+    @param parse_options: A bitwise or of clang.TranslationUnit.PARSE_XXX
+        flags used when parsing the file for extraction
 
-    @rtype: None
+    @type decls_pass: Boolean
+    @param decls_pass: If True then the file is first parsed with function
+        bodies skipped and is only fully parsed if it defines a function
+        using the PHP_FUNCTION or PHP_METHOD macros
+
+    @type split_jobs: Integer
+    @param split_jobs: The number of processes to split the functions of
+        the file between if it defines at least split_threshold functions
+
+    @type entries_out: List
+    @param entries_out: If given then the entries of the function entry
+        tables in the file are appended to this list, as for iter_records
+
+    @type headers: HeaderCache
+    @param headers: If given then the functions defined in the headers
+        included by the file are also extracted, unless the cache shows
+        that they have been already. See iter_header_records.
+
+    @type triage: Boolean
+    @param triage: If True then the parse is checked for a fatal error,
+        which is reported. Extraction goes ahead on the incomplete AST. A
+        file that the declarations pass would skip is parsed in full if
+        the declarations pass hit a fatal error.
+
+    @type retry_args: List of Strings
+    @param retry_args: If given along with triage then a file with a fatal
+        error is parsed again with these arguments added
+
+    @type triage_out: Dict
+    @param triage_out: If given along with triage then the keys 'fatal'
+        (the first fatal error of the parse used, or None) and 'retried'
+        are set in this dictionary before any records are yielded
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    log = logging.getLogger("iter_file_records")
+    log.debug("Compiler args: %s" % " ".join(list(args)))
+
+    # The index, and with it every translation unit parsed for this file, is
+    # disposed of as soon as the file is finished with rather than whenever
+    # the last Cursor referring to it happens to be collected
+    with clang.Index.create() as index:
+        if decls_pass:
+            with index.parse(src_file, args, options=DECLS_PASS_OPTIONS) as tu:
+                if not defines_php_functions(tu, src_file, globals_only):
+                    if not triage or first_fatal_error(tu) is None:
+                        log.debug("%s does not define any PHP functions" % \
+                                  src_file)
+                        return
+                    # e.g. php.h is missing, so PHP_FUNCTION was never
+                    # expanded. The file is parsed in full so that the
+                    # error is reported and the parse retried below.
+                    log.debug("The declarations pass of %s hit a fatal " \
+                              "error" % src_file)
+
+        tu = index.parse(src_file, args, options=parse_options)
+
+        if triage:
+            fatal = first_fatal_error(tu)
+            retried = False
+            if fatal is not None and retry_args:
+                log.info("Parsing %s again with %s after: %s" % \
+                         (src_file, " ".join(retry_args), fatal))
+                tu.close()
+                args = list(args) + list(retry_args)
+                tu = index.parse(src_file, args, options=parse_options)
+                fatal = first_fatal_error(tu)
+                retried = True
+
+            if fatal is not None:
+                log.error("Fatal error parsing %s: %s" % (src_file, fatal))
+            if triage_out is not None:
+                triage_out.update({"fatal" : fatal, "retried" : retried})
+
+        records = None
+        if split_jobs > 1:
+            func_count = count_functions(tu, src_file)
+            if func_count >= split_threshold:
+                log.info("Splitting the %d functions in %s between %d " \
+                         "processes" % (func_count, src_file, split_jobs))
+                records = iter_records_parallel(tu, src_file, split_jobs,
+                                                globals_only, prefilter,
+                                                use_indexer, entries_out)
+        if records is None:
+            records = iter_records(tu, src_file, globals_only, prefilter,
+                                   use_indexer, entries_out=entries_out)
+
+        if headers is not None:
+            records = itertools.chain(records,
+                iter_header_records(tu, macro_state(args), headers,
+                                    globals_only, prefilter))
+
+        for record in records:
+            yield record
+
+def process_file(src_file, args, **kwargs):
+    """Parse 'src_file' and return a map of the functions defined in it to
+    the format strings they pass to ZEND_FUNC. The keyword arguments are
+    those of iter_file_records.
+
+    @rtype: Dict
 
     """
 
-    with open(out_file, "ab") as fd:
-        fd.write("# %s\n" % src_file)
-        for func_name, fmt_strs in data.items():
-            fd.write("%s %s\n" % (func_name, " ".join(fmt_strs)))
+    records = iter_file_records(src_file, args, **kwargs)
+    return group_by_function(dedup_records(filter_records(records,
+                                                          has_format)))
+
+def extract_file(job, stream=False):
+    """Run the complete extraction for a single source file, including the
+    pre-screen. This is the unit of work handed to worker processes when
+    running in parallel.
+
+    @type job: Tuple of (String, List of Strings, Dict)
+    @param job: The source file, the arguments passed to the compiler for
+        it and a dictionary of settings. The settings are the keyword
+        arguments of iter_file_records along with 'prescreen',
+        'verify_rate' and 'diagnostics', as described for main. The
+        'headers' setting is a Boolean, and if it is True then the
+        HeaderCache of the calling process is used.
+
+    @type stream: Boolean
+    @param stream: If True then the records are returned as a generator
+        and the file is only parsed as it is consumed. Otherwise they are
+        returned as a list, so the result can be sent between processes.
+
+    @rtype: Dict
+    @return: A dictionary with the keys 'file', 'records' (all records
+        found, including those with no literal format string), 'entries'
+        (the FunctionEntry for each entry of the file's function entry
+        tables), 'triage' (as set by iter_file_records), 'skipped' and
+        'verified' (whether the file was rejected by the pre-screen and
+        whether it was parsed regardless). 'entries' and 'triage' are
+        complete once the records have been consumed.
+
+    """
+
+    global HEADER_CACHE
+    log = logging.getLogger("extract_file")
+
+    src_file, args, settings = job
+    settings = dict(settings)
+    prescreen = settings.pop("prescreen", False)
+    verify_rate = settings.pop("verify_rate", 0.0)
+    diagnostics = settings.pop("diagnostics", True)
+
+    if settings.pop("headers", False):
+        if HEADER_CACHE is None:
+            HEADER_CACHE = HeaderCache(prescreen)
+        settings["headers"] = HEADER_CACHE
+
+    res = {"file" : src_file, "records" : [], "entries" : [],
+           "triage" : {}, "skipped" : False, "verified" : False}
+
+    if prescreen and not file_may_call(src_file):
+        if random.random() >= verify_rate:
+            # Logged so that the files skipped can be audited
+            log.info("Skipping %s as it does not mention %s" % \
+                     (src_file, ZEND_FUNC))
+            res["skipped"] = True
+            return res
+        res["verified"] = True
+        # The file does not mention any of the identifiers that the
+        # prefilter and the indexer look for, so with either of them
+        # nothing would be found and the check could never fail
+        settings.update({"prefilter" : False, "use_indexer" : False,
+                         "decls_pass" : False})
+
+    if not diagnostics:
+        # Warnings are of no use to us and are expensive to collect
+        args = list(args) + ["-w"]
+
+    log.info("Processing %s" % src_file)
+    res["records"] = iter_file_records(src_file, args,
+                                       entries_out=res["entries"],
+                                       triage_out=res["triage"], **settings)
+    if not stream:
+        res["records"] = list(res["records"])
+    return res
+
+def iter_project_records(results, stats, entries_out=None, on_file_end=None):
+    """Flatten the results of extract_file for many files into a single
+    stream of records, tallying statistics as they pass
+
+    @type results: Iterable of Dict or jobs.JobResult
+    @param results: The results of extract_file, either direct or as
+        returned by a WorkerPool
 
-def main(cc_file, output_file, single_file=None, globals_only=False):
+    @type stats: Dict
+    @param stats: The counts of 'skipped' files, 'failed' files, files
+        with a 'fatal' error after any retry, files 'retried' and calls
+        with a variable format string ('var_arg_count') are added to this
+
+    @type entries_out: List
+    @param entries_out: If given then the function entries of each file
+        are appended to this list once its records have been yielded
+
+    @type on_file_end: Callable
+    @param on_file_end: If given then this is called with no arguments
+        once the records of each file have been yielded, and so passed
+        through any later stages, before waiting for the next file
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    log = logging.getLogger("iter_project_records")
+
+    # Each worker process has its own HeaderCache, so the functions of a
+    # header may be extracted by more than one of them
+    header_records = set()
+
+    for result in results:
+        if not isinstance(result, dict):
+            if not result.ok:
+                log.error("Failed to process %s: %s" % \
+                          (result.job[0], result.error))
+                stats["failed"] += 1
+                continue
+            result = result.value
+
+        if result["skipped"]:
+            stats["skipped"] += 1
+            continue
+
+        warned = not result["verified"]
+        for record in result["records"]:
+            if record.file != result["file"]:
+                key = (record.file, record.function, record.fmt_str,
+                       record.line, record.column)
+                if key in header_records:
+                    continue
+                header_records.add(key)
+            elif not warned and record.fmt_str is not None:
+                log.warning("The pre-screen would have skipped %s" % \
+                            result["file"])
+                warned = True
+
+            if record.fmt_str is None:
+                stats["var_arg_count"] += 1
+            yield record
+
+        if entries_out is not None:
+            entries_out.extend(result.get("entries", []))
+
+        triage = result.get("triage", {})
+        if triage.get("fatal") is not None:
+            stats["fatal"] += 1
+        if triage.get("retried"):
+            stats["retried"] += 1
+
+        if on_file_end is not None:
+            on_file_end()
+
+def main(cc_file, output_file, single_file=None, globals_only=False,
+         prefilter=False, prescreen=False, verify_rate=0.0, parse_options=0,
+         decls_pass=False, diagnostics=True, use_indexer=False, split_jobs=1,
+         split_threshold=1000, jobs=1, output_format="text", shard=None,
+         stats_file=None, max_worker_files=None, max_worker_rss=None,
+         api_file=None, symbol_index=None, headers=False, triage=False,
+         retry_args=None, shard_root=None):
     log = logging.getLogger("main")
 
     log.info("Loading compiler args from %s" % cc_file)
-    comp_args = load_project_data(cc_file)
+    comp_args = open_project_data(cc_file)
     log.info("Found compiler args for %d source files" % len(comp_args))
 
-    file_count = func_count = 0
-
     if single_file:
+        # Source files are recorded by their absolute path
+        single_file = os.path.abspath(single_file)
         if single_file not in comp_args:
             log.error("The file %s is not in the compiler arg log" % \
                       single_file)
+            close_project_data(comp_args)
             return -1
 
-        args = comp_args[single_file]
-
-        log.info("Processing %s" % single_file)
-        log.debug("Compiler args: %s" % " ".join(list(args)))
-
-        index = clang.Index.create()
-        tu = index.parse(single_file, args)
-        tu_data = process_all_functions(tu, single_file, globals_only)
-        log.info("Found %d functions in %s that call %s" % \
-                 (len(tu_data), single_file, ZEND_FUNC))
-        if len(tu_data):
-            file_count += 1
-            func_count += len(tu_data)
-            write_output(single_file, tu_data, output_file)
+        to_process = [(single_file, comp_args[single_file])]
     else:
         log.info("Processing all source files ...")
-
-        for src_file, args in comp_args.items():
-            log.info("Processing %s" % src_file)
-            log.debug("Compiler args: %s" % " ".join(list(args)))
-
-            index = clang.Index.create()
-            tu = index.parse(src_file, args)
-            tu_data = process_all_functions(tu, src_file, globals_only)
-            log.info("Found %d functions in %s that call %s" % \
-                     (len(tu_data), src_file, ZEND_FUNC))
-            if len(tu_data):
-                file_count += 1
-                func_count += len(tu_data)
-                write_output(src_file, tu_data, output_file)
+        to_process = comp_args.iteritems()
+
+    if shard is not None:
+        if shard_root is None:
+            shard_root = project_root(comp_args.iterkeys())
+        log.info("Processing shard %d of %d of the files under %s" % \
+                 (shard + (shard_root,)))
+        to_process = (item for item in to_process
+                      if in_shard(item[0], shard, shard_root))
+
+    settings = {"globals_only" : globals_only, "prefilter" : prefilter,
+                "prescreen" : prescreen, "verify_rate" : verify_rate,
+                "parse_options" : parse_options, "decls_pass" : decls_pass,
+                "diagnostics" : diagnostics, "use_indexer" : use_indexer,
+                "split_jobs" : split_jobs,
+                "split_threshold" : split_threshold, "headers" : headers,
+                "triage" : triage or bool(retry_args),
+                "retry_args" : retry_args}
+    job_list = ((src_file, args, settings) for src_file, args in to_process)
+
+    pool = None
+    if jobs > 1:
+        # Results are streamed back as each file completes
+        # Workers are recycled to bound the memory held by libclang and by
+        # the Python heap over a long run
+        pool = WorkerPool(extract_file, jobs, max_jobs=max_worker_files,
+                          max_rss=max_worker_rss)
+        results = pool.run(job_list)
+    else:
+        results = (extract_file(job, stream=True) for job in job_list)
+
+    stats = {"skipped" : 0, "failed" : 0, "fatal" : 0, "retried" : 0,
+             "var_arg_count" : 0}
+    entries = fmt_strs = None
+    if api_file:
+        # The entries of every table are joined with the format strings
+        # once all files have been processed, as a table may list
+        # functions defined in other files
+        entries = []
+        fmt_strs = {}
+
+    # The writer is flushed as soon as each file is finished rather than
+    # when the next file with results arrives
+    writer = RecordWriter(output_file, output_format)
+    records = iter_project_records(results, stats, entries, writer.end_file)
+    records = filter_records(records, has_format)
+    records = dedup_records(records)
+    if api_file:
+        records = collect_format_strings(records, fmt_strs)
+    symbols = None
+    if symbol_index:
+        symbols = SymbolIndex()
+        records = index_symbols(records, symbols)
+
+    try:
+        for record in records:
+            writer.write(record)
+    except KeyboardInterrupt:
+        log.error("Interrupted. Abandoning the remaining files.")
+        if pool is not None:
+            pool.cancel()
+        return -1
+    finally:
+        writer.close()
+        # The compiler arguments are read lazily as the files are processed
+        close_project_data(comp_args)
+    file_count, func_count = writer.file_count, writer.func_count
+
+    if pool is not None:
+        pool.close()
 
     log.info("API info for %d functions in %d files written to %s" % \
              (func_count, file_count, output_file))
+
+    if api_file:
+        entry_count = write_function_entries(
+            join_function_entries(entries, fmt_strs), api_file)
+        log.info("%d function entries written to %s" % \
+                 (entry_count, api_file))
+
+    if symbols is not None:
+        symbols.write(symbol_index)
+        stats["symbol_conflicts"] = len(symbols.conflicts())
+        log.info("%d symbols written to %s, of which %d have conflicting " \
+                 "format strings" % (len(symbols), symbol_index,
+                                     stats["symbol_conflicts"]))
+    log.info("%d files skipped by the pre-screen" % stats["skipped"])
+    if stats["failed"]:
+        log.info("%d files could not be processed" % stats["failed"])
+    if stats["retried"]:
+        log.info("%d files parsed again after a fatal error" % \
+                 stats["retried"])
+    if stats["fatal"]:
+        log.info("%d files had a fatal parse error" % stats["fatal"])
     log.info("%d calls to %s with variable parameters" % \
-             (VAR_ARG_COUNT, ZEND_FUNC))
+             (stats["var_arg_count"], ZEND_FUNC))
+
+    if stats_file:
+        stats.update({"files" : file_count, "functions" : func_count})
+        with open(stats_file, "wb") as fd:
+            json.dump(stats, fd, sort_keys=True)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
     parser = argparse.ArgumentParser(description=DESC)
     parser.add_argument("-c", dest="cc_log", required=True,
-                      help="The file created by the compiler wrapper")
+                      help="The file created by the compiler wrapper or " + \
+                      "an index of it created by ccindex.py")
     parser.add_argument("-o", dest="output_file", required=True,
-                      help="The name of the output file")
+                      help="The name of the output file, or - for stdout")
     parser.add_argument("-s", dest="single_file", default=None,
                       help="Specify a single source file to process")
     parser.add_argument("--globals_only", dest="globals_only",
                         action="store_true", default=False,
                         help="If specified then we exclude class methods " + \
                         "from the results")
+    parser.add_argument("--prefilter", dest="prefilter",
+                        action="store_true", default=False,
+                        help="Only traverse the functions whose source " + \
+                        "text mentions %s or a " % ZEND_FUNC + \
+                        "--wrapper_macro. Calls made through other " + \
+                        "macros are missed. Ignored with --use_indexer.")
+    parser.add_argument("--prescreen", dest="prescreen",
+                        action="store_true", default=False,
+                        help="Do not parse the source files and headers " + \
+                        "that do not mention %s or a " % ZEND_FUNC + \
+                        "--wrapper_macro. Calls made through other " + \
+                        "macros are missed. Each file skipped is logged.")
+    parser.add_argument("--verify_skipped", dest="verify_rate", type=float,
+                        default=0.0,
+                        help="With --prescreen, the fraction of the " + \
+                        "files rejected by it to parse anyway, " + \
+                        "reporting any that turn out to call %s" % ZEND_FUNC)
+    parser.add_argument("--wrapper_macro", dest="wrapper_macros",
+                        action="append", default=[],
+                        help="The name of a macro that expands to a call " + \
+                        "to %s. May be given multiple times." % ZEND_FUNC)
+    parser.add_argument("--parse_flag", dest="parse_flags",
+                        action="append", default=[],
+                        choices=sorted(PARSE_FLAGS.keys()),
+                        help="A libclang parse flag to use when parsing " + \
+                        "files for extraction. May be given multiple times.")
+    parser.add_argument("--decls_pass", dest="decls_pass",
+                        action="store_true", default=False,
+                        help="Parse each file with function bodies " + \
+                        "skipped first and only fully parse those that " + \
+                        "define PHP functions or methods")
+    parser.add_argument("--no_diagnostics", dest="diagnostics",
+                        action="store_false", default=True,
+                        help="Do not collect compiler warnings")
+    parser.add_argument("--use_indexer", dest="use_indexer",
+                        action="store_true", default=False,
+                        help="Use libclang's indexer to find the functions " + \
+                        "that reference %s before traversing them" % ZEND_FUNC)
+    parser.add_argument("--split_jobs", dest="split_jobs", type=int,
+                        default=1,
+                        help="The number of processes to split the " + \
+                        "functions of very large files between")
+    parser.add_argument("--split_threshold", dest="split_threshold",
+                        type=int, default=1000,
+                        help="The number of functions a file must define " + \
+                        "before it is split between processes")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="The number of files to process in parallel")
+    parser.add_argument("--format", dest="output_format", default="text",
+                        choices=["text", "jsonl"],
+                        help="Write the results as text or as one JSON " + \
+                        "object per line for each call found")
+    parser.add_argument("--shard", dest="shard", type=parse_shard,
+                        default=None,
+                        help="Only process the source files in shard i " + \
+                        "of N, given as i/N. See shards.py.")
+    parser.add_argument("--shard_root", dest="shard_root", default=None,
+                        help="The directory that source file paths are " + \
+                        "relative to when assigning them to shards. " + \
+                        "Defaults to the deepest directory containing " + \
+                        "every source file.")
+    parser.add_argument("--stats_file", dest="stats_file", default=None,
+                        help="Write the run's statistics to this file " + \
+                        "as JSON")
+    parser.add_argument("--max_worker_files", dest="max_worker_files",
+                        type=int, default=None,
+                        help="With --jobs, replace each worker process " + \
+                        "after it has processed this many files")
+    parser.add_argument("--max_worker_rss", dest="max_worker_rss",
+                        type=int, default=None,
+                        help="With --jobs, replace a worker process once " + \
+                        "its resident memory exceeds this many megabytes")
+    parser.add_argument("--api_file", dest="api_file", default=None,
+                        help="Also write each entry of the " + \
+                        "zend_function_entry tables, with its arginfo " + \
+                        "and format strings, to this file as JSON lines")
+    parser.add_argument("--headers", dest="headers", action="store_true",
+                        default=False,
+                        help="Also extract the functions defined in the " + \
+                        "headers included by each file, once for each " + \
+                        "version of a header and set of -D/-U options")
+    parser.add_argument("--triage", dest="triage", action="store_true",
+                        default=False,
+                        help="Check each parse for fatal errors, e.g. a " + \
+                        "missing header, and report the first one")
+    parser.add_argument("--retry_arg", dest="retry_args", action="append",
+                        default=[],
+                        help="An argument to add to the compiler " + \
+                        "arguments when parsing a file again after a " + \
+                        "fatal error, given as e.g. --retry_arg=-I/path. " + \
+                        "Implies --triage. May be given multiple times.")
+    parser.add_argument("--symbol_index", dest="symbol_index", default=None,
+                        help="Write an index of the functions found, " + \
+                        "merged across files by USR, to this file as JSON")
     args = parser.parse_args()
 
     cc_log = args.cc_log
     output_file = args.output_file
     single_file = args.single_file
     globals_only = args.globals_only
-
-    sys.exit(main(cc_log, output_file, single_file, globals_only))
+    prefilter = args.prefilter
+    prescreen = args.prescreen
+    verify_rate = args.verify_rate
+    decls_pass = args.decls_pass
+    diagnostics = args.diagnostics
+    use_indexer = args.use_indexer
+    split_jobs = args.split_jobs
+    split_threshold = args.split_threshold
+    jobs = args.jobs
+    output_format = args.output_format
+    shard = args.shard
+    shard_root = args.shard_root
+    if shard_root is not None:
+        shard_root = os.path.abspath(shard_root)
+    stats_file = args.stats_file
+    max_worker_files = args.max_worker_files
+    api_file = args.api_file
+    symbol_index = args.symbol_index
+    headers = args.headers
+    triage = args.triage
+    retry_args = args.retry_args
+    max_worker_rss = None
+    if args.max_worker_rss:
+        max_worker_rss = args.max_worker_rss * 1024 * 1024
+    TARGET_IDENTIFIERS.extend(args.wrapper_macros)
+
+    parse_options = 0
+    for flag in args.parse_flags:
+        parse_options |= PARSE_FLAGS[flag]
+
+    sys.exit(main(cc_log, output_file, single_file, globals_only, prefilter,
+                  prescreen, verify_rate, parse_options, decls_pass,
+                  diagnostics, use_indexer, split_jobs, split_threshold,
+                  jobs, output_format, shard, stats_file, max_worker_files,
+                  max_worker_rss, api_file, symbol_index, headers, triage,
+                  retry_args, shard_root))
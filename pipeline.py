@@ -0,0 +1,351 @@
+"""Composable stages for streaming the records extracted by parse_php.
+
+Extraction yields a FormatRecord for each call to zend_parse_parameters as
+soon as it is found. Records for the calls in one function are always
+yielded together, as are the functions of one file. The stages below rely on
+this so that none of them need to hold more than the records of a single
+function, and so memory use does not grow with the size of the tree.
+
+A pipeline is built by wrapping one generator in another, e.g.
+
+    records = filter_records(records, has_format)
+    records = dedup_records(records)
+    write_records(records, "out.txt")
+
+"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import sys
+import json
+
+from collections import namedtuple
+
+# A single call to zend_parse_parameters. fmt_str is None if the format
+# string could not be determined. out_params is the number of arguments
+# passed to receive the parsed parameters and out_param_types the spelling of
+# the type of each. php_class and php_name give the PHP class (None for
+# functions) and name of the function or method making the call, and usr the
+# function's Unified Symbol Resolution, which identifies it across translation
+# units. The fields after fmt_str are None where they are unknown, which is
+# their default.
+FormatRecord = namedtuple("FormatRecord",
+                          ["file", "function", "fmt_str", "line", "column",
+                           "out_params", "out_param_types", "php_class",
+                           "php_name", "usr"])
+FormatRecord.__new__.__defaults__ = (None,) * 7
+
+# A single entry of a zend_function_entry table, i.e. a function or method
+# registered with PHP. handler is the C function implementing it and table
+# the name of the table. arg_names and required_args are read from the arginfo
+# given for the entry, and fmt_strs are the format strings of the handler's
+# calls to zend_parse_parameters. As for FormatRecord, the fields after
+# handler are None where they are unknown.
+FunctionEntry = namedtuple("FunctionEntry",
+                           ["file", "table", "php_class", "php_name",
+                            "handler", "arg_names", "required_args",
+                            "fmt_strs"])
+FunctionEntry.__new__.__defaults__ = (None,) * 3
+
+def has_format(record):
+    """Predicate for filter_records that keeps only the records with a
+    non-empty, literal format string
+
+    """
+
+    return bool(record.fmt_str)
+
+def filter_records(records, predicate):
+    """Yield the records for which 'predicate' returns True
+
+    @type records: Iterable of FormatRecord
+    @param records: The records to filter
+
+    @type predicate: Callable
+    @param predicate: Called with each record
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    for record in records:
+        if predicate(record):
+            yield record
+
+def dedup_records(records):
+    """Drop records that repeat the format string of an earlier call in the
+    same function. The first record, and hence location, for each format
+    string is kept.
+
+    @type records: Iterable of FormatRecord
+    @param records: The records to deduplicate
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    current = None
+    seen = set()
+    for record in records:
+        if (record.file, record.function) != current:
+            current = (record.file, record.function)
+            seen = set()
+        if record.fmt_str in seen:
+            continue
+        seen.add(record.fmt_str)
+        yield record
+
+def group_by_function(records):
+    """Collect the format strings of each function into a dictionary. This
+    holds all of the results in memory and so is intended for the records
+    of a single file.
+
+    @type records: Iterable of FormatRecord
+    @param records: The records to collect
+
+    @rtype: Dict
+    @return: A mapping of function names to lists of format strings
+
+    """
+
+    res = {}
+    for record in records:
+        res.setdefault(record.function, []).append(record.fmt_str)
+    return res
+
+def index_by_php_name(records):
+    """Index records by the PHP function or method that they belong to. As
+    for group_by_function all records are held in memory.
+
+    @type records: Iterable of FormatRecord
+    @param records: The records to index
+
+    @rtype: Dict
+    @return: A mapping of (class, name) pairs to lists of records, where
+        class is None for functions. Records that do not belong to a PHP
+        function or method are omitted.
+
+    """
+
+    res = {}
+    for record in records:
+        if record.php_name is not None:
+            res.setdefault((record.php_class, record.php_name),
+                           []).append(record)
+    return res
+
+def collect_format_strings(records, out):
+    """Pass 'records' through unchanged, adding the format string of each to
+    'out'. Only the format strings themselves are held, so this can be used
+    to remember the results of a whole run.
+
+    @type records: Iterable of FormatRecord
+    @param records: The records to collect from
+
+    @type out: Dict
+    @param out: A mapping of function names to a mapping of file names to
+        the list of format strings found for that function in that file
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    for record in records:
+        out.setdefault(record.function, {}).setdefault(record.file,
+            []).append(record.fmt_str)
+        yield record
+
+def join_function_entries(entries, fmt_strs):
+    """Fill in the fmt_strs field of each of 'entries' from the format
+    strings found for its handler. A handler defined in the same file as
+    the table is preferred, otherwise the handler must be defined in
+    exactly one file. The field is left as None if no format strings were
+    found for the handler.
+
+    @type entries: Iterable of FunctionEntry
+    @param entries: The entries to join
+
+    @type fmt_strs: Dict
+    @param fmt_strs: Format strings as collected by collect_format_strings
+
+    @rtype: Generator of FunctionEntry
+
+    """
+
+    for entry in entries:
+        by_file = fmt_strs.get(entry.handler, {})
+        if entry.file in by_file:
+            entry = entry._replace(fmt_strs=by_file[entry.file])
+        elif len(by_file) == 1:
+            entry = entry._replace(fmt_strs=by_file.values()[0])
+        yield entry
+
+class RecordWriter(object):
+    """Sink that appends records to a file, or to stdout if the file name is
+    "-". Output is flushed after each file's results so that a consumer
+    reading from a pipe sees them as soon as possible. The end of a file's
+    results is only known for certain once the next file's first record is
+    written, so a producer that knows when a file is finished should call
+    end_file then.
+
+    In the text format each file is introduced by a "# <file>" line and is
+    followed by one line per function giving its name and format strings.
+    In the jsonl format each record is written as a JSON object on its own
+    line.
+
+    @ivar file_count: The number of files for which records were written
+    @ivar func_count: The number of functions for which records were written
+
+    """
+
+    FORMATS = ("text", "jsonl")
+
+    def __init__(self, out_file, output_format="text"):
+        if output_format not in self.FORMATS:
+            raise ValueError("Unknown output format %s" % output_format)
+
+        self.output_format = output_format
+        if out_file == "-":
+            self.fd = sys.stdout
+        else:
+            self.fd = open(out_file, "ab")
+
+        self.file_count = 0
+        self.func_count = 0
+        self._file = None
+        self._function = None
+        self._fmt_strs = []
+
+    def _end_function(self):
+        if self._function is not None and self.output_format == "text":
+            self.fd.write("%s %s\n" % (self._function,
+                                       " ".join(self._fmt_strs)))
+        self._function = None
+        self._fmt_strs = []
+
+    def end_file(self):
+        """Write out and flush the results of the current file"""
+
+        self._end_function()
+        self.fd.flush()
+
+    def write(self, record):
+        if record.file != self._file:
+            self.end_file()
+            self._file = record.file
+            self.file_count += 1
+            if self.output_format == "text":
+                self.fd.write("# %s\n" % record.file)
+
+        if record.function != self._function:
+            self._end_function()
+            self._function = record.function
+            self.func_count += 1
+
+        if self.output_format == "jsonl":
+            self.fd.write(json.dumps(record._asdict()))
+            self.fd.write("\n")
+        else:
+            self._fmt_strs.append(record.fmt_str)
+
+    def close(self):
+        self._end_function()
+        if self.fd is sys.stdout:
+            self.fd.flush()
+        else:
+            self.fd.close()
+
+def _from_json(value):
+    """Convert the unicode strings in a decoded JSON value to str"""
+
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    return value
+
+def read_records(in_file, input_format="text"):
+    """Read back the records written by a RecordWriter. Records read from
+    the text format carry no location and only one record is produced for
+    each format string of a function.
+
+    @type in_file: String
+    @param in_file: The file to read
+
+    @type input_format: String
+    @param input_format: One of RecordWriter.FORMATS
+
+    @rtype: Generator of FormatRecord
+
+    """
+
+    if input_format not in RecordWriter.FORMATS:
+        raise ValueError("Unknown input format %s" % input_format)
+
+    with open(in_file, "rb") as fd:
+        src_file = None
+        for line in fd:
+            line = line.rstrip("\n")
+            if not len(line):
+                continue
+
+            if input_format == "jsonl":
+                yield FormatRecord(**dict((str(k), _from_json(v))
+                                          for k, v in json.loads(line).items()
+                                          if k in FormatRecord._fields))
+            elif line.startswith("# "):
+                src_file = line[2:]
+            else:
+                fields = line.split(" ")
+                for fmt_str in fields[1:]:
+                    yield FormatRecord(src_file, fields[0], fmt_str)
+
+def write_function_entries(entries, out_file):
+    """Append 'entries' to 'out_file', or to stdout if it is "-", as one JSON
+    object per line
+
+    @type entries: Iterable of FunctionEntry
+    @param entries: The entries to write
+
+    @rtype: Integer
+    @return: The number of entries written
+
+    """
+
+    if out_file == "-":
+        fd = sys.stdout
+    else:
+        fd = open(out_file, "ab")
+
+    count = 0
+    try:
+        for entry in entries:
+            fd.write(json.dumps(entry._asdict()))
+            fd.write("\n")
+            count += 1
+    finally:
+        if fd is sys.stdout:
+            fd.flush()
+        else:
+            fd.close()
+
+    return count
+
+def write_records(records, out_file, output_format="text"):
+    """Write all of 'records' to 'out_file'. See RecordWriter.
+
+    @rtype: Tuple of (Integer, Integer)
+    @return: The number of files and functions for which records were
+        written
+
+    """
+
+    writer = RecordWriter(out_file, output_format)
+    try:
+        for record in records:
+            writer.write(record)
+    finally:
+        writer.close()
+
+    return (writer.file_count, writer.func_count)
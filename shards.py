@@ -0,0 +1,298 @@
+"""Split the extraction for a build between several hosts and merge the
+results.
+
+parse_php.py --shard i/N processes only the source files whose path hashes
+to shard i of N. The hash is the one used by ccindex, so it is stable across
+hosts and Python versions and every file belongs to exactly one shard. The
+path hashed is relative to the root of the project, which by default is the
+deepest directory containing every source file in the compiler log, so
+checkouts at different locations on different hosts are split the same way.
+Each shard writes its own output file and, with --stats_file, its
+statistics. The statistics of the shards are summed and written with
+--stats_out.
+
+merge_outputs combines the outputs of the shards into a single file in a
+fixed order: files sorted by path and, within each file, functions sorted by
+name. The result does not depend on the number of shards or the order in
+which they completed. Run as a script this module merges existing shard
+outputs, or with --local runs every shard as a local process first.
+
+"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import sys
+import json
+import logging
+import argparse
+import subprocess
+
+from interparser.ccindex import path_hash
+from interparser.symbols import SymbolIndex, index_symbols, \
+        load_symbol_index
+from interparser.pipeline import RecordWriter, read_records, write_records
+
+DESC = "Merge the outputs of sharded runs of parse_php.py"
+
+PARSE_PHP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "parse_php.py")
+
+# Statistics that cannot be summed across shards. They are recomputed from
+# the merged results where possible.
+NON_ADDITIVE_STATS = ("symbol_conflicts",)
+
+def parse_shard(shard):
+    """Parse a shard specification of the form i/N
+
+    @type shard: String
+    @param shard: The specification, with 0 <= i < N
+
+    @rtype: Tuple of (Integer, Integer)
+    @return: The shard index and the number of shards
+
+    """
+
+    try:
+        index, count = [int(x) for x in shard.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is not of the form i/N" % shard)
+
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("Invalid shard %s" % shard)
+
+    return (index, count)
+
+def project_root(src_files):
+    """Return the deepest directory containing all of 'src_files'
+
+    @type src_files: Iterable of Strings
+    @param src_files: Absolute source file paths
+
+    @rtype: String
+
+    """
+
+    dirs = [os.path.dirname(f) for f in src_files]
+    if not len(dirs):
+        return os.sep
+
+    # commonprefix compares character by character, so the prefix may end
+    # part of the way through a directory name
+    prefix = os.path.commonprefix(dirs)
+    if all(d == prefix or d.startswith(prefix.rstrip(os.sep) + os.sep)
+           for d in dirs):
+        return prefix
+    return os.path.dirname(prefix)
+
+def in_shard(src_file, shard, root=os.sep):
+    """Check if 'src_file' belongs to 'shard', an (index, count) pair. The
+    path is hashed relative to 'root', the root of the project.
+
+    """
+
+    return path_hash(os.path.relpath(src_file, root)) % shard[1] == shard[0]
+
+def merge_stats(stats_files):
+    """Sum the statistics written by each shard with --stats_file. Those in
+    NON_ADDITIVE_STATS are left out.
+
+    @type stats_files: List of Strings
+    @param stats_files: The files to merge
+
+    @rtype: Dict
+
+    """
+
+    res = {}
+    for stats_file in stats_files:
+        with open(stats_file, "rb") as fd:
+            for k, v in json.load(fd).items():
+                if isinstance(v, (int, long)) and \
+                        k not in NON_ADDITIVE_STATS:
+                    res[str(k)] = res.get(str(k), 0) + v
+    return res
+
+def merge_outputs(in_files, out_file, output_format="text",
+                  symbol_index=None):
+    """Merge the outputs of several shards into 'out_file'. Format strings
+    repeated for the same function are only written once.
+
+    @type in_files: List of Strings
+    @param in_files: The output files of the shards
+
+    @type out_file: String
+    @param out_file: The file to write the merged output to
+
+    @type output_format: String
+    @param output_format: The format of both the inputs and the output. One
+        of pipeline.RecordWriter.FORMATS.
+
+    @type symbol_index: String
+    @param symbol_index: If set then an index of the merged records by USR
+        is written to this file. See symbols.SymbolIndex. Only records read
+        from the jsonl format carry a USR.
+
+    @rtype: Tuple of (Integer, Integer)
+    @return: The number of files and functions written
+
+    """
+
+    # Maps (file, function) to its records in the order they were found
+    functions = {}
+    seen = set()
+    for in_file in in_files:
+        for record in read_records(in_file, output_format):
+            key = (record.file, record.function)
+            if key + (record.fmt_str,) in seen:
+                continue
+            seen.add(key + (record.fmt_str,))
+            functions.setdefault(key, []).append(record)
+
+    records = (r for k in sorted(functions) for r in functions[k])
+    if symbol_index is None:
+        return write_records(records, out_file, output_format)
+
+    symbols = SymbolIndex()
+    res = write_records(index_symbols(records, symbols), out_file,
+                        output_format)
+    symbols.write(symbol_index)
+    return res
+
+def run_local(cc_file, out_file, count, output_format="text", extra_args=None,
+              symbol_index=None, stats_out=None):
+    """Run every shard of an extraction as a separate local process and
+    merge the results. This stands in for distributing the shards between
+    hosts.
+
+    @type cc_file: String
+    @param cc_file: The compiler argument log or index, as for parse_php.py
+
+    @type out_file: String
+    @param out_file: The file to write the merged output to. The output of
+        shard i is written to out_file.i and its statistics to
+        out_file.i.stats
+
+    @type count: Integer
+    @param count: The number of shards
+
+    @type extra_args: List of Strings
+    @param extra_args: Further options to pass to each run of parse_php.py
+
+    @type symbol_index: String
+    @param symbol_index: As for merge_outputs
+
+    @type stats_out: String
+    @param stats_out: The file to write the merged statistics of the shards
+        to. Defaults to out_file.stats.
+
+    @rtype: Integer
+    @return: 0 on success or -1 if any shard failed
+
+    """
+
+    log = logging.getLogger("run_local")
+
+    if extra_args is None:
+        extra_args = []
+
+    procs = []
+    for i in range(count):
+        shard_out = "%s.%d" % (out_file, i)
+        for f in (shard_out, shard_out + ".stats"):
+            if os.path.exists(f):
+                os.unlink(f)
+        cmd = [sys.executable, PARSE_PHP, "-c", cc_file, "-o", shard_out,
+               "--shard", "%d/%d" % (i, count), "--format", output_format,
+               "--stats_file", shard_out + ".stats"] + extra_args
+        log.info("Starting shard %d/%d" % (i, count))
+        procs.append((shard_out, subprocess.Popen(cmd)))
+
+    ret = 0
+    for shard_out, p in procs:
+        if p.wait() != 0:
+            log.error("The shard writing %s exited with %d" % \
+                      (shard_out, p.returncode))
+            ret = -1
+    if ret != 0:
+        return ret
+
+    if stats_out is None:
+        stats_out = out_file + ".stats"
+
+    shard_outs = [shard_out for shard_out, p in procs]
+    main(shard_outs, out_file, output_format,
+         [s + ".stats" for s in shard_outs], symbol_index, stats_out)
+    return 0
+
+def main(in_files, out_file, output_format="text", stats_files=None,
+         symbol_index=None, stats_out=None):
+    log = logging.getLogger("main")
+
+    file_count, func_count = merge_outputs(in_files, out_file, output_format,
+                                           symbol_index)
+    log.info("Merged %d functions in %d files from %d shards into %s" % \
+             (func_count, file_count, len(in_files), out_file))
+
+    if stats_files:
+        stats = merge_stats(stats_files)
+        if symbol_index:
+            stats["symbol_conflicts"] = len(
+                [e for e in load_symbol_index(symbol_index).values()
+                 if e["conflict"]])
+        for k in sorted(stats):
+            log.info("%s: %d" % (k, stats[k]))
+
+        if stats_out:
+            log.info("Writing merged statistics to %s" % stats_out)
+            with open(stats_out, "wb") as fd:
+                json.dump(stats, fd, sort_keys=True)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument("-o", dest="output_file", required=True,
+                        help="The name of the merged output file")
+    parser.add_argument("--format", dest="output_format", default="text",
+                        choices=list(RecordWriter.FORMATS),
+                        help="The format of the shard outputs")
+    parser.add_argument("--stats_file", dest="stats_files",
+                        action="append", default=[],
+                        help="A statistics file written by a shard. May " + \
+                        "be given multiple times.")
+    parser.add_argument("--stats_out", dest="stats_out", default=None,
+                        help="Write the summed statistics of the shards " + \
+                        "to this file as JSON. With --local this " + \
+                        "defaults to the output file name plus .stats.")
+    parser.add_argument("--local", dest="local", type=int, default=0,
+                        help="Run this many shards as local processes " + \
+                        "and merge their outputs")
+    parser.add_argument("-c", dest="cc_log", default=None,
+                        help="The compiler argument log to use with --local")
+    parser.add_argument("--symbol_index", dest="symbol_index", default=None,
+                        help="Write an index of the merged records by " + \
+                        "USR to this file. Requires --format jsonl.")
+    parser.add_argument("in_files", nargs="*",
+                        help="The outputs of the shards to merge")
+    # With --local any unrecognised options are passed on to parse_php.py
+    args, extra_args = parser.parse_known_args()
+
+    if args.symbol_index and args.output_format != "jsonl":
+        parser.error("--symbol_index requires --format jsonl")
+
+    if args.local:
+        if args.cc_log is None:
+            parser.error("-c is required with --local")
+        sys.exit(run_local(args.cc_log, args.output_file, args.local,
+                           args.output_format, args.in_files + extra_args,
+                           args.symbol_index, args.stats_out))
+    elif len(extra_args):
+        parser.error("unrecognized arguments: %s" % " ".join(extra_args))
+
+    if args.stats_out and not len(args.stats_files):
+        parser.error("--stats_out requires --stats_file")
+
+    sys.exit(main(args.in_files, args.output_file, args.output_format,
+                  args.stats_files, args.symbol_index, args.stats_out))
@@ -0,0 +1,163 @@
+"""Index the functions found in a run across translation units.
+
+The same function can be extracted from several translation units, e.g. a
+static inline helper from a header, or a PHP function defined under
+different #ifdefs in more than one file. The records of a run list it once
+per file. SymbolIndex merges them by the function's USR, which is the same
+in every translation unit for the same entity, and picks one canonical
+definition for each.
+
+Where the definitions of a function in different files use different sets
+of format strings, the symbol is flagged as a conflict and the format strings
+of each file are kept. The index is written as a single JSON object keyed by
+USR, so a consumer can look up any function directly instead of reconciling
+the records of every file itself.
+
+"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import sys
+import json
+
+class SymbolIndex(object):
+    """Merge of FormatRecords by USR. Only the format strings and the
+    location of the first record in each file are held for each symbol.
+
+    """
+
+    def __init__(self):
+        # Maps each USR to a dictionary holding the function's name, PHP
+        # name and, for each file it was found in, its first location and
+        # format strings
+        self._symbols = {}
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def __contains__(self, usr):
+        return usr in self._symbols
+
+    def add(self, record):
+        """Add a record to the index. Records without a USR are ignored.
+
+        @type record: pipeline.FormatRecord
+        @param record: The record to add
+
+        """
+
+        if record.usr is None:
+            return
+
+        symbol = self._symbols.get(record.usr)
+        if symbol is None:
+            symbol = self._symbols[record.usr] = {
+                "function" : record.function,
+                "php_class" : record.php_class,
+                "php_name" : record.php_name,
+                "files" : {}}
+
+        if record.file not in symbol["files"]:
+            symbol["files"][record.file] = {"line" : record.line,
+                                            "column" : record.column,
+                                            "fmt_strs" : []}
+        fmt_strs = symbol["files"][record.file]["fmt_strs"]
+        if record.fmt_str not in fmt_strs:
+            fmt_strs.append(record.fmt_str)
+
+    def lookup(self, usr):
+        """Return the entry for 'usr' as written by write, or None if it is
+        not in the index
+
+        @type usr: String
+        @param usr: The USR of the function
+
+        @rtype: Dict
+
+        """
+
+        symbol = self._symbols.get(usr)
+        if symbol is None:
+            return None
+
+        files = sorted(symbol["files"])
+        canonical = symbol["files"][files[0]]
+        # The order of the calls in a function does not matter
+        variants = set(frozenset(f["fmt_strs"])
+                       for f in symbol["files"].values())
+
+        res = {"function" : symbol["function"],
+               "php_class" : symbol["php_class"],
+               "php_name" : symbol["php_name"],
+               "file" : files[0], "line" : canonical["line"],
+               "column" : canonical["column"],
+               "fmt_strs" : canonical["fmt_strs"], "files" : files,
+               "conflict" : len(variants) > 1}
+        if res["conflict"]:
+            res["variants"] = dict((f, symbol["files"][f]["fmt_strs"])
+                                   for f in files)
+        return res
+
+    def conflicts(self):
+        """Return the USRs of the symbols whose definitions in different
+        files use different sets of format strings
+
+        @rtype: List of Strings
+
+        """
+
+        return sorted(usr for usr in self._symbols
+                      if self.lookup(usr)["conflict"])
+
+    def write(self, out_file):
+        """Write the index to 'out_file', or to stdout if it is "-", as a
+        JSON object mapping each USR to its entry. The canonical definition
+        of a symbol is the one in the first file, in sorted order, in which
+        it was found. 'files' lists all of the files, and 'variants' gives
+        the format strings found in each if they conflict.
+
+        @type out_file: String
+        @param out_file: The file to write the index to
+
+        """
+
+        index = dict((usr, self.lookup(usr)) for usr in self._symbols)
+        if out_file == "-":
+            json.dump(index, sys.stdout, sort_keys=True)
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+        else:
+            with open(out_file, "wb") as fd:
+                json.dump(index, fd, sort_keys=True)
+
+def index_symbols(records, index):
+    """Pass 'records' through unchanged, adding each to 'index'
+
+    @type records: Iterable of pipeline.FormatRecord
+    @param records: The records to index
+
+    @type index: SymbolIndex
+    @param index: The index to add them to
+
+    @rtype: Generator of pipeline.FormatRecord
+
+    """
+
+    for record in records:
+        index.add(record)
+        yield record
+
+def load_symbol_index(in_file):
+    """Load an index written by SymbolIndex.write
+
+    @type in_file: String
+    @param in_file: The file to read
+
+    @rtype: Dict
+    @return: A mapping of USRs to their entries
+
+    """
+
+    with open(in_file, "rb") as fd:
+        return json.load(fd)
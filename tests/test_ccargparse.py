@@ -0,0 +1,101 @@
+"""Tests for the parsing of the compiler wrapper's log in ccargparse.py"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from interparser.ccargparse import load_project_data, CompileArgsError
+
+class LoadProjectDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp(
+            prefix="test_ccargparse"))
+        self.src_dir = os.path.join(self.tmp_dir, "src")
+        os.mkdir(self.src_dir)
+        for name in ("a.c", "b.cpp"):
+            open(os.path.join(self.src_dir, name), "wb").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, lines):
+        """Write 'lines' to a log, encoding any that are not strings as
+        JSON records, and load it
+
+        """
+
+        log_file = os.path.join(self.tmp_dir, "cc.log")
+        with open(log_file, "wb") as fd:
+            for line in lines:
+                if not isinstance(line, str):
+                    line = json.dumps(line)
+                fd.write(line + "\n")
+        return load_project_data(log_file)
+
+    def src(self, name):
+        return os.path.join(self.src_dir, name)
+
+    def test_json_record(self):
+        res = self.load([{"cwd" : self.src_dir,
+                          "args" : ["-c", "a.c", "-o", "a.o", "-DX"]}])
+        self.assertEqual(res, {self.src("a.c") : ["-DX"]})
+
+    def test_legacy_record(self):
+        # Relative paths are resolved against the current directory
+        res = self.load([" ".join(["-c", self.src("a.c"), "-Iinc"])])
+        self.assertEqual(res, {self.src("a.c") :
+                               ["-I" + os.path.join(os.getcwd(), "inc")]})
+
+    def test_path_options(self):
+        res = self.load([{"cwd" : self.src_dir,
+                          "args" : ["-c", "a.c", "-I", "inc", "-Ifoo",
+                                    "-I../up", "--sysroot=root",
+                                    "-isystem", "/abs", "-includeh.h"]}])
+        self.assertEqual(res[self.src("a.c")],
+                         ["-I", self.src("inc"), "-I" + self.src("foo"),
+                          "-I" + os.path.join(self.tmp_dir, "up"),
+                          "--sysroot=" + self.src("root"),
+                          "-isystem", "/abs", "-include" + self.src("h.h")])
+
+    def test_path_option_exclusions(self):
+        # Options that only start with the name of a path option are not
+        # rewritten, and -include-pch takes a path itself
+        res = self.load([{"cwd" : self.src_dir,
+                          "args" : ["-c", "a.c", "-I-", "-include-pch",
+                                    "x.pch", "-iquote-dir", "-isystem",
+                                    "sys"]}])
+        self.assertEqual(res[self.src("a.c")],
+                         ["-I-", "-include-pch", self.src("x.pch"),
+                          "-iquote-dir", "-isystem", self.src("sys")])
+
+    def test_env_by_language(self):
+        env = {"CPATH" : "common", "C_INCLUDE_PATH" : "c_inc",
+               "CPLUS_INCLUDE_PATH" : "cpp_inc:/abs/cpp"}
+        res = self.load([{"cwd" : self.src_dir, "env" : env,
+                          "args" : ["-c", "a.c", "b.cpp", "-Iinc"]}])
+        self.assertEqual(res[self.src("a.c")],
+                         ["-I" + self.src("inc"), "-I", self.src("common"),
+                          "-isystem", self.src("c_inc")])
+        self.assertEqual(res[self.src("b.cpp")],
+                         ["-I" + self.src("inc"), "-I", self.src("common"),
+                          "-isystem", self.src("cpp_inc"),
+                          "-isystem", "/abs/cpp"])
+
+    def test_missing_source(self):
+        res = self.load([{"cwd" : self.src_dir,
+                          "args" : ["-c", "missing.c"]}])
+        self.assertEqual(res, {})
+
+    def test_conflicting_args(self):
+        self.assertRaises(CompileArgsError, self.load,
+                          [{"cwd" : self.src_dir, "args" : ["a.c", "-DX"]},
+                           {"cwd" : self.src_dir, "args" : ["a.c", "-DY"]}])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Tests for the compiled index of the compiler wrapper's log in ccindex.py"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from interparser.ccargparse import CompileArgsError
+from interparser.ccindex import write_index, compile_project_data, \
+        CompiledProjectData, HEADER, open_project_data, \
+        close_project_data
+
+class CompiledProjectDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_ccindex")
+        self.index_file = os.path.join(self.tmp_dir, "cc.idx")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def round_trip(self, comp_args):
+        self.assertEqual(write_index(comp_args, self.index_file),
+                         len(comp_args))
+        data = CompiledProjectData(self.index_file)
+        self.addCleanup(data.close)
+        return data
+
+    def test_round_trip(self):
+        comp_args = dict(("/src/f%d.c" % i, ["-DN=%d" % i, "-Iinc"])
+                         for i in range(100))
+        comp_args["/src/empty.c"] = []
+        data = self.round_trip(comp_args)
+
+        self.assertEqual(len(data), len(comp_args))
+        self.assertEqual(sorted(data.keys()), sorted(comp_args))
+        self.assertEqual(dict(data.iteritems()), comp_args)
+        for src_file, args in comp_args.items():
+            self.assertTrue(src_file in data)
+            self.assertEqual(data[src_file], args)
+
+    def test_missing_key(self):
+        data = self.round_trip({"/src/a.c" : ["-DA"]})
+        self.assertFalse("/src/b.c" in data)
+        self.assertEqual(data.get("/src/b.c"), None)
+        self.assertEqual(data.get("/src/b.c", []), [])
+        self.assertRaises(KeyError, lambda: data["/src/b.c"])
+
+    def test_empty_project(self):
+        data = self.round_trip({})
+        self.assertEqual(len(data), 0)
+        self.assertEqual(data.items(), [])
+        self.assertFalse("/src/a.c" in data)
+
+    def test_shared_argvecs(self):
+        # Each distinct argument vector is stored once
+        shared = ["-DX", "-I/inc"]
+        comp_args = {"/src/a.c" : shared, "/src/b.c" : list(shared),
+                     "/src/c.c" : ["-DY"]}
+        data = self.round_trip(comp_args)
+        self.assertEqual(dict(data.items()), comp_args)
+
+        n_argvecs = HEADER.unpack_from(data._mm, 0)[3]
+        self.assertEqual(n_argvecs, 2)
+
+    def test_not_an_index(self):
+        with open(self.index_file, "wb") as fd:
+            fd.write("-c a.c\n" + "\0" * HEADER.size)
+        self.assertRaises(CompileArgsError, CompiledProjectData,
+                          self.index_file)
+
+class OpenProjectDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp(
+            prefix="test_ccindex"))
+        self.src_file = os.path.join(self.tmp_dir, "a.c")
+        open(self.src_file, "wb").close()
+        self.log_file = os.path.join(self.tmp_dir, "cc.log")
+        with open(self.log_file, "wb") as fd:
+            fd.write(json.dumps({"cwd" : self.tmp_dir,
+                                 "args" : ["-c", "a.c", "-DX"]}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sniffing(self):
+        index_file = os.path.join(self.tmp_dir, "cc.idx")
+        self.assertEqual(compile_project_data(self.log_file, index_file), 1)
+
+        log_data = open_project_data(self.log_file)
+        self.assertTrue(isinstance(log_data, dict))
+        index_data = open_project_data(index_file)
+        self.assertTrue(isinstance(index_data, CompiledProjectData))
+        try:
+            self.assertEqual(dict(index_data.items()), log_data)
+        finally:
+            close_project_data(index_data)
+            close_project_data(log_data)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Tests for the WorkerPool in jobs.py"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import signal
+import unittest
+
+from interparser.jobs import WorkerPool
+
+# Seconds after which a test is failed rather than left to hang
+TIMEOUT = 60
+
+def _square(job):
+    return job * job
+
+def _raise_on_3(job):
+    if job == 3:
+        raise ValueError("bad job")
+    return job
+
+def _die_on_3(job):
+    if job == 3:
+        # As libclang would on a segfault, exit without flushing anything
+        os._exit(7)
+    return job
+
+class _DieOnReceive(object):
+    """A job that kills the worker while it is being received, before the
+    worker can start running it"""
+
+    def __reduce__(self):
+        return (os._exit, (9,))
+
+class _Timeout(Exception):
+    pass
+
+def _on_alarm(signum, frame):
+    raise _Timeout()
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._old_handler = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, self._old_handler)
+
+    def run_pool(self, func, jobs, workers=2, **kwargs):
+        pool = WorkerPool(func, workers, **kwargs)
+        try:
+            return list(pool.run(jobs))
+        finally:
+            pool.close()
+
+    def test_results(self):
+        results = self.run_pool(_square, range(10))
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(sorted(r.value for r in results),
+                         [x * x for x in range(10)])
+
+    def test_exception(self):
+        results = self.run_pool(_raise_on_3, range(10))
+        failed = [r.job for r in results if not r.ok]
+        self.assertEqual(failed, [3])
+        self.assertEqual(sorted(r.value for r in results if r.ok),
+                         [x for x in range(10) if x != 3])
+
+    def test_worker_death(self):
+        # The results of the jobs run by a worker before it dies must not be
+        # lost with it
+        results = self.run_pool(_die_on_3, range(10))
+        self.assertEqual(sorted(r.job for r in results), range(10))
+        failed = [r.job for r in results if not r.ok]
+        self.assertEqual(failed, [3])
+
+    def test_worker_death_single_worker(self):
+        results = self.run_pool(_die_on_3, range(10), workers=1)
+        self.assertEqual(sorted(r.job for r in results), range(10))
+        self.assertEqual([r.job for r in results if not r.ok], [3])
+
+    def test_worker_death_on_receive(self):
+        die = _DieOnReceive()
+        results = self.run_pool(_square, [1, 2, die, 4, 5])
+        self.assertEqual([r.job for r in results if not r.ok], [die])
+        self.assertEqual(sorted(r.value for r in results if r.ok),
+                         [1, 4, 16, 25])
+
+    def test_retirement(self):
+        results = self.run_pool(_square, range(20), max_jobs=3)
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(r.ok for r in results))
+
+if __name__ == "__main__":
+    unittest.main()
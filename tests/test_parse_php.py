@@ -0,0 +1,236 @@
+"""Tests for the extraction in parse_php.py. The tests of functions taking a
+translation unit parse small fixtures written to resemble PHP extensions and
+so need libclang.
+
+"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import clang.cindex as clang
+
+from interparser.parse_php import fast_zpp_fmt_str, iter_records, \
+        find_function_entries
+
+# Declarations and simplified versions of the PHP macros used by the
+# fixtures
+PHP_PRELUDE = r"""
+int zend_parse_parameters(int num_args, const char *type_spec, ...);
+
+#define ZEND_PARSE_PARAMETERS_START(min, max) \
+    do { int _min = (min), _max = (max); (void)_min; (void)_max;
+#define ZEND_PARSE_PARAMETERS_END() } while (0)
+#define Z_PARAM_OPTIONAL
+#define Z_PARAM_LONG(dest) (dest) = 0;
+#define Z_PARAM_STR(dest) (dest) = 0;
+"""
+
+# Pairs of Fast ZPP blocks and the equivalent ZEND_FUNC format string
+FAST_ZPP_CASES = [
+    ("ZEND_PARSE_PARAMETERS_START(1, 2) Z_PARAM_STR(a) Z_PARAM_OPTIONAL "
+     "Z_PARAM_LONG(b) ZEND_PARSE_PARAMETERS_END()", "S|l"),
+    # check_null and separate flags of the _EX and _EX2 variants
+    ("Z_PARAM_ARRAY_EX(a, 1, 0)", "a!"),
+    ("Z_PARAM_ARRAY_EX(a, 0, 1)", "a/"),
+    ("Z_PARAM_ARRAY_EX(a, true, true)", "a!/"),
+    ("Z_PARAM_ZVAL_EX2(z, 1, 1, 0)", "z!"),
+    ("Z_PARAM_ZVAL_EX2(z, 0, 1, 1)", "z/"),
+    ("Z_PARAM_ZVAL_EX(z, 0, 0)", "z"),
+    ("Z_PARAM_STRING_OR_NULL(s, l)", "s!"),
+    ("Z_PARAM_OBJECT_OF_CLASS_OR_NULL(o, ce)", "O!"),
+    # Nested brackets and commas in an argument
+    ("Z_PARAM_OBJECT_OF_CLASS(o, f(a, b[1])) Z_PARAM_LONG(l)", "Ol"),
+    ("Z_PARAM_VARIADIC('+', args, n)", "+"),
+    ("Z_PARAM_VARIADIC('*', args, n)", "*"),
+    ("Z_PARAM_VARIADIC()", "*"),
+    ("Z_PARAM_VARIADIC", "*"),
+    ("Z_PARAM_VARIADIC_WITH_NAMED(args, n, named)", "*"),
+    # Macros without a ZEND_FUNC equivalent are read as a zval
+    ("Z_PARAM_ARRAY_HT_OR_STR(h, s) Z_PARAM_LONG(l)", "zl"),
+]
+
+def _spellings(src):
+    """Split 'src' into token spellings as libclang would"""
+
+    for c in "(),[]":
+        src = src.replace(c, " %s " % c)
+    return src.split()
+
+class FastZPPFormatTest(unittest.TestCase):
+
+    def test_cases(self):
+        for src, fmt_str in FAST_ZPP_CASES:
+            self.assertEqual(fast_zpp_fmt_str(_spellings(src)), fmt_str,
+                             src)
+
+class FixtureTest(unittest.TestCase):
+    """Base class for tests that parse a C fixture"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_parse_php")
+        self.index = clang.Index.create()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def parse(self, source, options=0):
+        """Parse 'source', following PHP_PRELUDE, as a C file
+
+        @rtype: Tuple of (clang.cindex.TranslationUnit, String)
+        @return: The translation unit and the path of the fixture
+
+        """
+
+        path = os.path.join(self.tmp_dir, "fixture.c")
+        with open(path, "wb") as fd:
+            fd.write(PHP_PRELUDE)
+            fd.write(source)
+        return (self.index.parse(path, ["-x", "c"], options=options), path)
+
+class FastZPPBlocksTest(FixtureTest):
+
+    SOURCE = r"""
+void zif_f(int ht)
+{
+    long a;
+    char *b;
+
+    /* ZEND_PARSE_PARAMETERS_START(0, 0) */
+#if 0
+    ZEND_PARSE_PARAMETERS_START(0, 1)
+        Z_PARAM_STR(b)
+    ZEND_PARSE_PARAMETERS_END();
+#endif
+#ifdef FAST_ZPP
+    ZEND_PARSE_PARAMETERS_START(0, 1)
+        Z_PARAM_LONG(a)
+    ZEND_PARSE_PARAMETERS_END();
+#else
+    zend_parse_parameters(ht, "|s", &b);
+#endif
+    ZEND_PARSE_PARAMETERS_START(1, 2)
+        Z_PARAM_LONG(a)
+        Z_PARAM_OPTIONAL
+        Z_PARAM_STR(b)
+    ZEND_PARSE_PARAMETERS_END();
+}
+"""
+
+    def check(self, options):
+        tu, path = self.parse(self.SOURCE, options)
+        with tu:
+            records = list(iter_records(tu, path))
+        # Blocks in comments and code excluded by the preprocessor are
+        # ignored and do not swallow the real block
+        self.assertEqual(sorted(r.fmt_str for r in records), ["l|S", "|s"])
+        zpp = [r for r in records if r.fmt_str == "l|S"][0]
+        self.assertEqual(zpp.function, "zif_f")
+        self.assertEqual(zpp.line, PHP_PRELUDE.count("\n") +
+                         self.SOURCE[:self.SOURCE.index(
+                             "ZEND_PARSE_PARAMETERS_START(1, 2)")].count("\n")
+                         + 1)
+
+    def test_blocks(self):
+        self.check(0)
+
+    def test_blocks_detailed_record(self):
+        self.check(clang.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD)
+
+class OutParamTypesTest(FixtureTest):
+
+    SOURCE = r"""
+typedef struct _zval zval;
+
+void zif_f(int ht)
+{
+    long l;
+    void *p;
+    char buf[8];
+
+    zend_parse_parameters(ht, "lzs", &l, (zval **)&p, buf);
+}
+"""
+
+    def test_types(self):
+        tu, path = self.parse(self.SOURCE)
+        with tu:
+            records = list(iter_records(tu, path))
+        self.assertEqual(len(records), 1)
+        # The types passed, after any casts and conversions
+        self.assertEqual(records[0].out_params, 3)
+        self.assertEqual(records[0].out_param_types,
+                         ["long *", "zval **", "char *"])
+
+class ArgInfoTest(FixtureTest):
+
+    # The arginfo and function entry macros of PHP 7, in which the names
+    # are stringized and the number of required arguments is a macro
+    # argument cast to the type of the name field
+    SOURCE = r"""
+typedef unsigned long zend_uintptr_t;
+typedef void (*zif_handler)(int ht);
+
+typedef struct _zend_internal_arg_info {
+    const char *name;
+    const char *class_name;
+    int pass_by_reference;
+    int is_variadic;
+} zend_internal_arg_info;
+
+typedef struct _zend_function_entry {
+    const char *fname;
+    zif_handler handler;
+    const zend_internal_arg_info *arg_info;
+    unsigned num_args;
+    unsigned flags;
+} zend_function_entry;
+
+#define ZEND_BEGIN_ARG_INFO_EX(name, _unused, return_reference, \
+                               required_num_args) \
+    static const zend_internal_arg_info name[] = { \
+        { (const char*)(zend_uintptr_t)(required_num_args), 0, \
+          return_reference, 0 },
+#define ZEND_BEGIN_ARG_INFO(name, _unused) \
+    ZEND_BEGIN_ARG_INFO_EX(name, 0, 0, -1)
+#define ZEND_ARG_INFO(pass_by_ref, name) { #name, 0, pass_by_ref, 0 },
+#define ZEND_END_ARG_INFO() };
+
+#define PHP_FE(name, arg_info) { #name, zif_##name, arg_info, \
+    (unsigned)(sizeof(arg_info)/sizeof(zend_internal_arg_info)-1), 0 },
+#define PHP_FE_END { 0, 0, 0, 0, 0 }
+
+ZEND_BEGIN_ARG_INFO_EX(arginfo_f, 0, 0, 1)
+    ZEND_ARG_INFO(0, str)
+    ZEND_ARG_INFO(1, len)
+ZEND_END_ARG_INFO()
+
+ZEND_BEGIN_ARG_INFO(arginfo_g, 0)
+ZEND_END_ARG_INFO()
+
+void zif_f(int ht) {}
+void zif_g(int ht) {}
+
+static const zend_function_entry funcs[] = {
+    PHP_FE(f, arginfo_f)
+    PHP_FE(g, arginfo_g)
+    PHP_FE_END
+};
+"""
+
+    def test_arg_info(self):
+        tu, path = self.parse(self.SOURCE)
+        with tu:
+            entries = find_function_entries(tu.cursor.get_children(), path)
+        self.assertEqual([(e.php_name, e.handler, e.arg_names,
+                           e.required_args) for e in entries],
+                         [("f", "zif_f", ["str", "len"], 1),
+                          ("g", "zif_g", [], -1)])
+
+if __name__ == "__main__":
+    unittest.main()
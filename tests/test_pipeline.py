@@ -0,0 +1,119 @@
+"""Tests for the record pipeline stages in pipeline.py"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from interparser.pipeline import FormatRecord, FunctionEntry, has_format, \
+        filter_records, dedup_records, join_function_entries, \
+        RecordWriter, read_records, write_records
+
+def _record(src_file, function, fmt_str, **kwargs):
+    return FormatRecord(src_file, function, fmt_str, **kwargs)
+
+class FilterRecordsTest(unittest.TestCase):
+
+    def test_has_format(self):
+        records = [_record("a.c", "f", "s"), _record("a.c", "f", ""),
+                   _record("a.c", "g", None), _record("a.c", "g", "l|z")]
+        self.assertEqual([r.fmt_str for r in
+                          filter_records(records, has_format)],
+                         ["s", "l|z"])
+
+    def test_predicate(self):
+        records = [_record("a.c", "f", "s"), _record("b.c", "g", "l")]
+        self.assertEqual(list(filter_records(records,
+                                             lambda r: r.file == "b.c")),
+                         records[1:])
+
+class DedupRecordsTest(unittest.TestCase):
+
+    def test_same_function(self):
+        records = [_record("a.c", "f", "s", line=1),
+                   _record("a.c", "f", "l", line=2),
+                   _record("a.c", "f", "s", line=3)]
+        # The first location of a repeated format string is kept
+        self.assertEqual([(r.fmt_str, r.line) for r in
+                          dedup_records(records)],
+                         [("s", 1), ("l", 2)])
+
+    def test_function_boundary(self):
+        # The same format string in the next function, or in a function of
+        # the same name in the next file, is not a repeat
+        records = [_record("a.c", "f", "s"), _record("a.c", "g", "s"),
+                   _record("b.c", "g", "s"), _record("b.c", "g", "s")]
+        self.assertEqual([(r.file, r.function) for r in
+                          dedup_records(records)],
+                         [("a.c", "f"), ("a.c", "g"), ("b.c", "g")])
+
+class RecordRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_pipeline")
+        self.out_file = os.path.join(self.tmp_dir, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_text(self):
+        records = [_record("a.c", "f", "s"), _record("a.c", "f", "l|z"),
+                   _record("a.c", "g", "a"), _record("b.c", "h", "O")]
+        self.assertEqual(write_records(records, self.out_file, "text"),
+                         (2, 3))
+        self.assertEqual(list(read_records(self.out_file, "text")), records)
+
+    def test_jsonl(self):
+        records = [_record("a.c", "f", "s", line=10, column=5, out_params=2,
+                           out_param_types=["char **", "int *"],
+                           php_name="f", usr="c:@F@f"),
+                   _record("a.c", "f", None, line=12, column=5),
+                   _record("b.c", "m", "l", line=3, column=1,
+                           php_class="Foo", php_name="bar")]
+        self.assertEqual(write_records(records, self.out_file, "jsonl"),
+                         (2, 2))
+        read = list(read_records(self.out_file, "jsonl"))
+        self.assertEqual(read, records)
+        self.assertTrue(all(isinstance(r.file, str) for r in read))
+
+    def test_end_file(self):
+        writer = RecordWriter(self.out_file, "text")
+        try:
+            writer.write(_record("a.c", "f", "s"))
+            writer.end_file()
+            # A finished file's results are visible before close
+            with open(self.out_file, "rb") as fd:
+                self.assertEqual(fd.read(), "# a.c\nf s\n")
+        finally:
+            writer.close()
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, RecordWriter, self.out_file, "xml")
+
+class JoinFunctionEntriesTest(unittest.TestCase):
+
+    def entry(self, src_file, handler):
+        return FunctionEntry(src_file, "funcs", None, handler, handler)
+
+    def test_same_file_preferred(self):
+        fmt_strs = {"zif_f" : {"a.c" : ["s"], "b.c" : ["l"]}}
+        entries = list(join_function_entries([self.entry("b.c", "zif_f")],
+                                             fmt_strs))
+        self.assertEqual(entries[0].fmt_strs, ["l"])
+
+    def test_other_file(self):
+        # A handler defined in exactly one other file is used, one defined
+        # in several other files is ambiguous
+        fmt_strs = {"zif_f" : {"a.c" : ["s"]},
+                    "zif_g" : {"a.c" : ["s"], "b.c" : ["l"]}}
+        entries = list(join_function_entries([self.entry("c.c", "zif_f"),
+                                              self.entry("c.c", "zif_g"),
+                                              self.entry("c.c", "zif_h")],
+                                             fmt_strs))
+        self.assertEqual([e.fmt_strs for e in entries], [["s"], None, None])
+
+if __name__ == "__main__":
+    unittest.main()
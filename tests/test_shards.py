@@ -0,0 +1,130 @@
+"""Tests for the sharding and merging of extraction runs in shards.py"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import unittest
+
+from interparser.pipeline import FormatRecord, read_records, write_records
+from interparser.shards import parse_shard, in_shard, project_root, \
+        merge_outputs, merge_stats, main
+from interparser.symbols import load_symbol_index
+
+SRC_FILES = ["ext/%s/%s%d.c" % (ext, ext, i)
+             for ext in ("standard", "date", "pcre") for i in range(30)]
+
+class ShardTest(unittest.TestCase):
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("0/1"), (0, 1))
+        self.assertEqual(parse_shard("3/4"), (3, 4))
+        for shard in ("4/4", "-1/4", "0/0", "1", "a/b", "1/2/3"):
+            self.assertRaises(argparse.ArgumentTypeError, parse_shard, shard)
+
+    def test_partition(self):
+        # Every file belongs to exactly one shard
+        root = "/home/a/php-src"
+        paths = [os.path.join(root, f) for f in SRC_FILES]
+        for count in range(1, 6):
+            shards = [[p for p in paths if in_shard(p, (i, count), root)]
+                      for i in range(count)]
+            self.assertEqual(sorted(sum(shards, [])), sorted(paths))
+
+    def test_root_independent(self):
+        # Checkouts at different locations are split the same way
+        for count in (2, 3, 7):
+            for f in SRC_FILES:
+                self.assertEqual(
+                    [in_shard(os.path.join("/home/a/php-src", f), (i, count),
+                              "/home/a/php-src") for i in range(count)],
+                    [in_shard(os.path.join("/build/php", f), (i, count),
+                              "/build/php") for i in range(count)])
+
+    def test_project_root(self):
+        self.assertEqual(project_root(["/a/src/x.c", "/a/src/y/z.c"]),
+                         "/a/src")
+        # The common prefix of /a/src and /a/srcx is not a directory of both
+        self.assertEqual(project_root(["/a/src/x.c", "/a/srcx/y.c"]), "/a")
+        self.assertEqual(project_root(["/a/x.c", "/b/y.c"]), "/")
+        self.assertEqual(project_root(["/a/b/x.c"]), "/a/b")
+        self.assertEqual(project_root([]), "/")
+
+class MergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_shards")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def write_shards(self, output_format):
+        shards = [[FormatRecord("b.c", "g", "s", 1, 1, usr="c:@F@g"),
+                   FormatRecord("b.c", "f", "l", 5, 1, usr="c:@F@f")],
+                  [FormatRecord("a.c", "h", "z", 2, 1, usr="c:@F@h"),
+                   FormatRecord("a.c", "f", "S", 7, 1, usr="c:@F@f"),
+                   FormatRecord("b.c", "g", "s", 1, 1, usr="c:@F@g")]]
+        in_files = []
+        for i, records in enumerate(shards):
+            in_files.append(self.path("out.%d.%s" % (i, output_format)))
+            write_records(records, in_files[-1], output_format)
+        return in_files
+
+    def test_merge_outputs(self):
+        for output_format in ("text", "jsonl"):
+            out_file = self.path("merged." + output_format)
+            in_files = self.write_shards(output_format)
+            # The shards are merged in a fixed order and repeated format
+            # strings are only written once
+            self.assertEqual(merge_outputs(in_files, out_file,
+                                           output_format), (2, 4))
+            self.assertEqual([(r.file, r.function, r.fmt_str) for r in
+                              read_records(out_file, output_format)],
+                             [("a.c", "f", "S"), ("a.c", "h", "z"),
+                              ("b.c", "f", "l"), ("b.c", "g", "s")])
+
+            # The result does not depend on the order of the shards
+            reversed_file = self.path("reversed." + output_format)
+            merge_outputs(in_files[::-1], reversed_file, output_format)
+            with open(out_file, "rb") as a, open(reversed_file, "rb") as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_symbol_index(self):
+        in_files = self.write_shards("jsonl")
+        index_file = self.path("symbols.json")
+        merge_outputs(in_files, self.path("merged"), "jsonl", index_file)
+        index = load_symbol_index(index_file)
+        self.assertEqual(sorted(index), ["c:@F@f", "c:@F@g", "c:@F@h"])
+        self.assertEqual(index["c:@F@f"]["files"], ["a.c", "b.c"])
+        self.assertTrue(index["c:@F@f"]["conflict"])
+        self.assertFalse(index["c:@F@g"]["conflict"])
+
+    def test_stats(self):
+        stats_files = []
+        for i, stats in enumerate([{"skipped" : 2, "symbol_conflicts" : 1},
+                                   {"skipped" : 3, "symbol_conflicts" : 0,
+                                    "failed" : 1}]):
+            stats_files.append(self.path("out.%d.stats" % i))
+            with open(stats_files[-1], "wb") as fd:
+                json.dump(stats, fd)
+
+        # Conflicts between shards are not seen by either shard, so the
+        # count is not summed but taken from the merged symbol index
+        self.assertEqual(merge_stats(stats_files),
+                         {"skipped" : 5, "failed" : 1})
+        stats_out = self.path("merged.stats")
+        main(self.write_shards("jsonl"), self.path("merged"), "jsonl",
+             stats_files, self.path("symbols.json"), stats_out)
+        with open(stats_out, "rb") as fd:
+            self.assertEqual(json.load(fd), {"skipped" : 5, "failed" : 1,
+                                             "symbol_conflicts" : 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Tests for the index of extracted functions by USR in symbols.py"""
+
+__author__= "Sean Heelan"
+__email__ = "sean.heelan@gmail.com"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from interparser.pipeline import FormatRecord
+from interparser.symbols import SymbolIndex, index_symbols, \
+        load_symbol_index
+
+def _record(src_file, fmt_str, line=1, usr="c:@F@zif_f"):
+    return FormatRecord(src_file, "zif_f", fmt_str, line, 3,
+                        php_name="f", usr=usr)
+
+class SymbolIndexTest(unittest.TestCase):
+
+    def test_add_lookup(self):
+        index = SymbolIndex()
+        index.add(_record("b.c", "s", line=10))
+        index.add(_record("b.c", "l", line=12))
+        index.add(_record("a.c", "s", line=20))
+        index.add(_record("a.c", "l", line=22))
+        # Records without a USR are ignored
+        index.add(_record("a.c", "s", usr=None))
+
+        self.assertEqual(len(index), 1)
+        self.assertTrue("c:@F@zif_f" in index)
+        self.assertEqual(index.lookup("c:@F@missing"), None)
+
+        # The first file in sorted order is canonical, and the location is
+        # that of the first record in it
+        res = index.lookup("c:@F@zif_f")
+        self.assertEqual(res, {"function" : "zif_f", "php_class" : None,
+                               "php_name" : "f", "file" : "a.c",
+                               "line" : 20, "column" : 3,
+                               "fmt_strs" : ["s", "l"],
+                               "files" : ["a.c", "b.c"],
+                               "conflict" : False})
+        self.assertEqual(index.conflicts(), [])
+
+    def test_order_is_not_a_conflict(self):
+        index = SymbolIndex()
+        for record in [_record("a.c", "s"), _record("a.c", "l"),
+                       _record("b.c", "l"), _record("b.c", "s"),
+                       _record("b.c", "s")]:
+            index.add(record)
+        self.assertFalse(index.lookup("c:@F@zif_f")["conflict"])
+        self.assertEqual(index.conflicts(), [])
+
+    def test_conflict(self):
+        index = SymbolIndex()
+        for record in [_record("a.c", "s"), _record("b.c", "s"),
+                       _record("b.c", "l"),
+                       _record("a.c", "z", usr="c:@F@other")]:
+            index.add(record)
+
+        res = index.lookup("c:@F@zif_f")
+        self.assertTrue(res["conflict"])
+        self.assertEqual(res["variants"], {"a.c" : ["s"],
+                                           "b.c" : ["s", "l"]})
+        self.assertEqual(index.conflicts(), ["c:@F@zif_f"])
+
+    def test_index_symbols(self):
+        index = SymbolIndex()
+        records = [_record("a.c", "s"), _record("a.c", "l", usr=None)]
+        self.assertEqual(list(index_symbols(records, index)), records)
+        self.assertEqual(len(index), 1)
+
+class WriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_symbols")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        index = SymbolIndex()
+        for record in [_record("a.c", "s"), _record("b.c", "l"),
+                       _record("a.c", "z", usr="c:@F@zif_g")]:
+            index.add(record)
+
+        out_file = os.path.join(self.tmp_dir, "symbols.json")
+        index.write(out_file)
+        loaded = load_symbol_index(out_file)
+        self.assertEqual(sorted(loaded), ["c:@F@zif_f", "c:@F@zif_g"])
+        for usr in loaded:
+            self.assertEqual(loaded[usr], index.lookup(usr))
+
+if __name__ == "__main__":
+    unittest.main()